@@ -0,0 +1,232 @@
+# backtester.py - Vectorized walk-forward backtest of main.py's scoring and weight-learning loop
+import argparse
+import itertools
+import json
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import main as strategy
+from market_data import column
+from news_fetcher import MAX_ENTRIES_PER_FEED
+from price_store import fetch_with_store
+from sentiment_cache import SentimentCache
+
+# --- تنظیمات ---
+BACKTEST_OUTPUT_FILE = "backtest_results.json"
+CURRENCIES = list(strategy.CURRENCY_RSS_FEEDS)
+# همان جفت‌های ماتریس واگرایی main.py (همه ترکیب‌ها به ترتیب قرارداد بازار، شامل کراس‌ها)
+PAIRS = [base + quote for i, base in enumerate(strategy.CURRENCY_PRIORITY) for quote in strategy.CURRENCY_PRIORITY[i + 1:]]
+PARAM_NAMES = ["news_weight", "leading_weight", "regime_weight", "threshold", "learning_rate"]
+
+def make_param_grid(news_weight=None, leading_weight=None, regime_weight=None, threshold=None, learning_rate=None):
+    """
+    Cartesian product of the given values as {name: array}; unspecified axes use the live settings
+    from main.py, so make_param_grid() is exactly the strategy that runs every 5 minutes.
+    """
+    axes = {
+        "news_weight": news_weight or [strategy.ANALYSIS_WEIGHTS["news_sentiment"]],
+        "leading_weight": leading_weight or [strategy.ANALYSIS_WEIGHTS["leading_indicators"]],
+        "regime_weight": regime_weight or [strategy.ANALYSIS_WEIGHTS["market_regime"]],
+        "threshold": threshold or [strategy.DIVERGENCE_THRESHOLD],
+        "learning_rate": learning_rate or [strategy.WEIGHT_LEARNING_RATE],
+    }
+    combos = np.array(list(itertools.product(*(axes[name] for name in PARAM_NAMES))), dtype=np.float64)
+    return {name: combos[:, i] for i, name in enumerate(PARAM_NAMES)}
+
+def _asof(series, grid, bar=None):
+    """Last value at or before each grid time; with `bar`, values are keyed by the end of their bar."""
+    series = series.astype(np.float64)
+    if bar is not None:
+        series.index = series.index + bar
+    return series.reindex(series.index.union(grid)).ffill().reindex(grid).to_numpy()
+
+def _daily_asof(series, grid):
+    """A daily series as known at each grid time: a bar is used only once its day has closed."""
+    return _asof(series, grid, pd.Timedelta(days=1))
+
+def news_scores(grid, headlines, entries=MAX_ENTRIES_PER_FEED):
+    """
+    (T, C) news score per currency at every grid time, same time decay as get_nlp_sentiment_for_feed:
+    sum of compound * max(0, 1 - age/24h), scaled by 10 and rounded. Like the live feed, only the
+    newest `entries` headlines published by each grid time are counted.
+    """
+    grid_ts = grid.as_unit("s").asi8.astype(np.float64)
+    scores = np.zeros((len(grid), len(CURRENCIES)))
+    for c, currency in enumerate(CURRENCIES):
+        rows = sorted((published, compound) for cur, published, compound in headlines if cur == currency and published is not None)
+        if not rows:
+            continue
+        published, compound = np.array(rows).T
+        # سرخط‌های مرتب‌شده بر اساس زمان؛ در هر گام فقط پنجره [seen - entries, seen) دیده می‌شود
+        seen = np.searchsorted(published, grid_ts, side="right")
+        position = np.arange(len(published))
+        visible = (position[None, :] < seen[:, None]) & (position[None, :] >= seen[:, None] - entries)
+        age_hours = (grid_ts[:, None] - published[None, :]) / 3600
+        decay = np.where(visible, np.clip(1 - age_hours / 24.0, 0, 1), 0)
+        scores[:, c] = decay @ compound
+    return np.round(scores * 10)
+
+def load_history(start, end, step_minutes=5, cache=None):
+    """
+    Builds every input of the replay on a regular grid: pair closes (T, K), regime and
+    leading-indicator bias (T, C) from daily market data, and news scores (T, C) from the headline archive.
+    `closes` is the live price rule at prediction time (close of the bar that has started);
+    `end_closes` only uses bars that have closed, so a review never sees prices after its step.
+    """
+    grid = pd.date_range(pd.Timestamp(start).floor("h"), pd.Timestamp(end), freq=f"{step_minutes}min")
+
+    pair_tickers = [strategy.pair_ticker(pair) for pair in PAIRS]
+    hourly = fetch_with_store(pair_tickers, start=grid[0].to_pydatetime(), interval="1h")
+    closes = np.full((len(grid), len(PAIRS)), np.nan)
+    end_closes = np.full((len(grid), len(PAIRS)), np.nan)
+    for k, ticker in enumerate(pair_tickers):
+        try:
+            series = column(hourly, 'Close', ticker)
+            closes[:, k] = _asof(series, grid)
+            # میله‌های ساعتی با زمان شروع برچسب دارند؛ قیمت پایان فقط از میله‌های بسته‌شده
+            end_closes[:, k] = _asof(series, grid, pd.Timedelta(hours=1))
+        except KeyError:
+            print(f"Backtest: no hourly prices for {ticker}")
+
+    daily = fetch_with_store(strategy.MARKET_TICKERS, start=(grid[0] - pd.Timedelta(days=45)).to_pydatetime(), interval="1d")
+    regime_bias = np.zeros((len(grid), len(CURRENCIES)))
+    leading_bias = np.zeros((len(grid), len(CURRENCIES)))
+    try:
+        sp500 = column(daily, 'Close', "^GSPC")
+        above = _daily_asof(sp500 > sp500.rolling(window=20).mean(), grid) == 1
+        below = _daily_asof(sp500 < sp500.rolling(window=20).mean(), grid) == 1
+        vix = _daily_asof(column(daily, 'Close', "^VIX"), grid)
+        regime = np.where(above & (vix < 20), 1, np.where(below & (vix > 25), -1, 0))
+        sign = np.array([1 if c in strategy.COMMODITY_CURRENCIES else -1 if c in strategy.SAFE_HAVENS else 0 for c in CURRENCIES])
+        regime_bias = regime[:, None] * sign[None, :] * strategy.REGIME_BIAS
+    except KeyError as e:
+        print(f"Backtest: market regime unavailable ({e}), using Neutral")
+    for ticker, bias in strategy.LEADING_INDICATOR_BIAS.items():
+        try:
+            close = column(daily, 'Close', ticker)
+            trend = _daily_asof(close.rolling(window=5).mean() > close.rolling(window=20).mean(), grid) == 1
+        except KeyError:
+            print(f"Backtest: no daily prices for {ticker}")
+            continue
+        leading_bias += trend[:, None] * np.array([bias.get(c, 0) for c in CURRENCIES])[None, :]
+
+    own_cache = cache is None
+    cache = cache or SentimentCache()
+    headlines = cache.archived_headlines(grid[0].timestamp() - 24 * 3600, grid[-1].timestamp())
+    if own_cache:
+        cache.close()
+    return {"grid": grid, "closes": closes, "end_closes": end_closes, "news": news_scores(grid, headlines),
+            "leading": leading_bias, "regime": regime_bias, "step_minutes": step_minutes}
+
+def run_backtest(history, params, initial_weights=None):
+    """
+    Replays run_main_analysis + review_past_predictions over the grid for all P parameter sets at once.
+    Everything that does not depend on the learned weights is precomputed as (P, T, C) arrays; only the
+    weight recurrence steps through time, as array operations over parameter sets and pairs.
+    Like the live prediction ledger, each step opens up to MAX_PREDICTIONS_PER_RUN ranked predictions
+    for pairs without an open one; an open prediction is reviewed at the first step inside the review
+    window and expires once it is older than the window.
+    """
+    closes, end_closes, news = history["closes"], history["end_closes"], history["news"]
+    T, P, C = len(history["grid"]), len(params["threshold"]), len(CURRENCIES)
+    hours_per_step = history["step_minutes"] / 60.0
+    base_idx = np.array([CURRENCIES.index(pair[:3]) for pair in PAIRS])
+    quote_idx = np.array([CURRENCIES.index(pair[3:]) for pair in PAIRS])
+    low, high = strategy.WEIGHT_BOUNDS
+    review_from, review_to = strategy.REVIEW_WINDOW_HOURS
+
+    static_part = (history["leading"][None] * params["leading_weight"][:, None, None]
+                   + history["regime"][None] * params["regime_weight"][:, None, None])
+    news_part = news[None] * params["news_weight"][:, None, None]
+    up, down = 1 + params["learning_rate"], 1 - params["learning_rate"]
+
+    weights = np.ones((P, C))
+    if initial_weights:
+        weights[:] = [initial_weights.get(c, 1.0) for c in CURRENCIES]
+    trajectory = np.empty((P, T, C))
+    K = min(strategy.MAX_PREDICTIONS_PER_RUN, len(PAIRS))
+    # پیش‌بینی باز هر جفت: گام ثبت (۱- یعنی بسته) و جهت پیش‌بینی
+    open_t = np.full((P, len(PAIRS)), -1)
+    open_move = np.zeros((P, len(PAIRS)))
+    predictions, reviews, hits = np.zeros(P, dtype=int), np.zeros(P, dtype=int), np.zeros(P, dtype=int)
+    rows = np.arange(P)
+
+    for t in range(T):
+        # ۱. بررسی پیش‌بینی‌های باز ۴ تا ۸ ساعت قبل و تنظیم وزن‌ها (جفت به جفت، مانند ترتیب دفتر)
+        is_open = open_t >= 0
+        age = (t - open_t) * hours_per_step
+        made = np.maximum(open_t, 0)
+        start_price, end_price = closes[made, np.arange(len(PAIRS))[None, :]], end_closes[t][None, :]
+        due = is_open & (age > review_from) & (age < review_to) & ~np.isnan(start_price) & ~np.isnan(end_price)
+        for k in np.flatnonzero(due.any(axis=0)):
+            r = rows[due[:, k]]
+            correct = np.where(end_price[0, k] > start_price[r, k], 1, -1) == open_move[r, k]
+            b, q = base_idx[k], quote_idx[k]
+            weights[r, b] = np.where(correct, np.minimum(high, weights[r, b] * up[r]), np.maximum(low, weights[r, b] * down[r]))
+            weights[r, q] = np.where(correct, np.maximum(low, weights[r, q] * down[r]), np.minimum(high, weights[r, q] * up[r]))
+            reviews[r] += 1
+            hits[r] += correct
+        open_t[due | (is_open & (age >= review_to))] = -1
+
+        # ۲. امتیاز نهایی، ماتریس واگرایی و پیش‌بینی‌های رتبه‌بندی‌شده بالای آستانه برای جفت‌های بدون پیش‌بینی باز
+        final = np.round(news_part[:, t] * weights + static_part[:, t])
+        divergence = final[:, base_idx] - final[:, quote_idx]
+        strength = np.where(open_t >= 0, -1.0, np.abs(divergence))
+        ranked = np.argsort(-strength, axis=1, kind="stable")[:, :K]
+        new = np.take_along_axis(strength, ranked, axis=1) > params["threshold"][:, None]
+        r, k = np.broadcast_to(rows[:, None], ranked.shape)[new], ranked[new]
+        open_t[r, k], open_move[r, k] = t, np.sign(divergence[r, k])
+        predictions += new.sum(axis=1)
+        trajectory[:, t] = weights
+
+    return {"predictions": predictions, "reviews": reviews, "hits": hits,
+            "hit_rate": np.divide(hits, reviews, out=np.zeros(P), where=reviews > 0),
+            "final_weights": weights, "trajectory": trajectory}
+
+def report(params, result, elapsed, steps):
+    P = len(params["threshold"])
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "param_sets": P,
+        "steps": steps,
+        "elapsed_seconds": elapsed,
+        "simulated_runs_per_second": P * steps / elapsed if elapsed > 0 else None,
+        "results": sorted([{
+            "params": {name: float(params[name][p]) for name in PARAM_NAMES},
+            "predictions": int(result["predictions"][p]),
+            "reviews": int(result["reviews"][p]),
+            "hit_rate": float(result["hit_rate"][p]),
+            "final_weights": dict(zip(CURRENCIES, np.round(result["final_weights"][p], 4).tolist())),
+        } for p in range(P)], key=lambda r: r["hit_rate"], reverse=True),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the main.py strategy")
+    parser.add_argument("--days", type=int, default=30)
+    # همان فاصله اجرای main.py در workflow؛ فقط با این گام نتیجه با حلقه یادگیری واقعی منطبق است
+    parser.add_argument("--step-minutes", type=int, default=5)
+    for name in PARAM_NAMES:
+        parser.add_argument("--" + name.replace("_", "-"), type=float, nargs="+")
+    parser.add_argument("--output", default=BACKTEST_OUTPUT_FILE)
+    parser.add_argument("--trajectories", help="optional .npz file for the (P, T, C) weight trajectories")
+    args = parser.parse_args()
+
+    end = datetime.now()
+    history = load_history(end - timedelta(days=args.days), end, args.step_minutes)
+    params = make_param_grid(**{name: getattr(args, name) for name in PARAM_NAMES})
+    initial_weights = strategy.load_memory().get("weights")
+
+    start = time.perf_counter()
+    result = run_backtest(history, params, initial_weights)
+    elapsed = time.perf_counter() - start
+
+    output = report(params, result, elapsed, len(history["grid"]))
+    with open(args.output, "w") as f: json.dump(output, f, indent=2)
+    if args.trajectories:
+        np.savez_compressed(args.trajectories, trajectory=result["trajectory"], grid=history["grid"].asi8, currencies=CURRENCIES)
+    print(f"Backtest: {output['param_sets']} parameter sets x {output['steps']} steps in {elapsed:.3f}s "
+          f"({output['simulated_runs_per_second']:.0f} simulated runs/s). Results saved to '{args.output}'")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# benchmarks/bench_news.py - Sequential vs concurrent vs conditional-GET feed fetching
+import sys
+import time
+
+import feedparser
+
+from benchmarks.fixture_server import start_fixture_server
+from benchmarks.make_fixtures import FEED_NAMES
+from news_fetcher import fetch_all_feeds
+
+def main(delay=0.3, lowercase_headers=False):
+    server, base_url = start_fixture_server(delays={"*": delay}, lowercase_headers=lowercase_headers)
+    feeds = {name: f"{base_url}/rss/{name}.xml" for name in FEED_NAMES}
+    try:
+        start = time.perf_counter()
+        for url in feeds.values(): feedparser.parse(url)
+        sequential = time.perf_counter() - start
+
+        state = {}
+        start = time.perf_counter()
+        fetch_all_feeds(feeds, state)
+        concurrent_cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fetch_all_feeds(feeds, state)
+        concurrent_warm = time.perf_counter() - start
+        # بدون ETag/Last-Modified ذخیره‌شده اجرای دوم همه فیدها را دوباره دانلود می‌کند
+        validators = sum(1 for record in state.values() if record.get("etag") or record.get("modified"))
+    finally:
+        server.shutdown()
+    print(f"Per-feed delay {delay:.2f}s over {len(feeds)} feeds")
+    print(f"  sequential:            {sequential:.3f}s")
+    print(f"  concurrent (cold):     {concurrent_cold:.3f}s")
+    print(f"  concurrent (304 warm): {concurrent_warm:.3f}s")
+    print(f"  validators stored:     {validators}/{len(feeds)}{' (lowercase headers)' if lowercase_headers else ''}")
+    if validators < len(feeds):
+        raise SystemExit("conditional GET broken: some feeds have no stored ETag/Last-Modified")
+
+if __name__ == "__main__":
+    # python -m benchmarks.bench_news 0.3 --lowercase-headers
+    args = [a for a in sys.argv[1:] if a != "--lowercase-headers"]
+    main(float(args[0]) if args else 0.3, "--lowercase-headers" in sys.argv)
@@ -0,0 +1,65 @@
+# benchmarks/fixture_server.py - Local HTTP server for offline feed benchmarks
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+class FixtureRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves fixture files with ETag/Last-Modified and answers conditional GETs with 304.
+    With `lowercase_headers` the header names go out as "etag"/"last-modified", as some servers send them.
+    """
+    delays = {}
+    lowercase_headers = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_header(self, keyword, value):
+        super().send_header(keyword.lower() if self.lowercase_headers else keyword, value)
+
+    def do_GET(self):
+        time.sleep(self.delays.get(self.path, self.delays.get("*", 0.0)))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f: body = f.read()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        mtime = int(os.path.getmtime(path))
+        if self.headers.get("If-None-Match") == etag or self._not_modified_since(mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified_since(self, mtime):
+        since = self.headers.get("If-Modified-Since")
+        if not since or self.headers.get("If-None-Match"): return False
+        try:
+            return mtime <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+def start_fixture_server(directory=FIXTURE_DIR, delays=None, port=0, lowercase_headers=False):
+    """
+    Starts the server on a background thread and returns (server, base_url).
+    `delays` maps a request path (or "*") to seconds of artificial latency.
+    """
+    handler = type("Handler", (FixtureRequestHandler,), {"delays": dict(delays or {}), "lowercase_headers": lowercase_headers})
+    server_class = type("Server", (ThreadingHTTPServer,), {"request_queue_size": 128})
+    server = server_class(("127.0.0.1", port), lambda *a: handler(*a, directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
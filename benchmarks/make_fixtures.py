@@ -0,0 +1,102 @@
+# benchmarks/make_fixtures.py - Deterministic offline fixtures for the benchmarks
+import argparse
+import os
+import random
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+import backtester
+import liquidity_analyzer
+import main as sentiment_analysis
+from benchmarks.fixture_server import FIXTURE_DIR
+from market_data import FileProvider, YFinanceProvider
+
+OHLCV_DIR = os.path.join(FIXTURE_DIR, "ohlcv")
+FIXTURE_END = datetime(2026, 1, 5, 12, 0, tzinfo=timezone.utc)
+DAILY_BARS = 250
+# liquidity_analyzer همه بازه‌ها را از LOOKBACK_DAYS روز میله ساعتی می‌سازد؛ یک هفته اضافه برای جابه‌جایی FileProvider
+HOURLY_DAYS = liquidity_analyzer.LOOKBACK_DAYS + 10
+# همه تیکرهایی که دو اسکریپت استفاده می‌کنند
+DAILY_TICKERS = list(dict.fromkeys([s + "=X" for s in liquidity_analyzer.PRIMARY_SYMBOLS] + list(liquidity_analyzer.CORRELATION_SYMBOLS.values())
+                                   + sentiment_analysis.MARKET_TICKERS + list(sentiment_analysis.CURRENCY_PAIRS_YF.values())))
+# شامل همه ۲۸ جفت ماتریس واگرایی که main.py بررسی و backtester.py بازپخش می‌کند
+HOURLY_TICKERS = list(dict.fromkeys([s + "=X" for s in liquidity_analyzer.PRIMARY_SYMBOLS] + list(liquidity_analyzer.CORRELATION_SYMBOLS.values())
+                                    + list(sentiment_analysis.CURRENCY_PAIRS_YF.values())
+                                    + [sentiment_analysis.pair_ticker(pair) for pair in backtester.PAIRS]))
+
+FEED_NAMES = ['USD', 'EUR', 'GBP', 'JPY', 'NZD', 'CAD', 'AUD', 'CHF', 'World']
+HEADLINE_TEMPLATES = [
+    "{c} rallies as inflation data beats expectations",
+    "{c} slumps after weak jobs report",
+    "Central bank holds rates, {c} steady",
+    "Traders cut bets on {c} as growth outlook darkens",
+    "{c} surges to multi-week high on strong retail sales",
+    "Recession fears weigh on {c}",
+    "{c} little changed ahead of policy decision",
+    "Upbeat PMI lifts {c} and regional stocks",
+]
+
+def write_rss_fixture(path, name, items=25, seed=0, now=None):
+    rng = random.Random(seed)
+    now = now or FIXTURE_END
+    rows = []
+    for i in range(items):
+        title = rng.choice(HEADLINE_TEMPLATES).format(c=name)
+        published = now - timedelta(minutes=rng.randint(0, 36 * 60))
+        rows.append(f"<item><title>{escape(title)}</title><guid isPermaLink=\"false\">{name}-{seed}-{i}</guid>"
+                    f"<pubDate>{format_datetime(published)}</pubDate></item>")
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+                f"<title>{name} fixture</title>{''.join(rows)}</channel></rss>")
+
+def make_rss_fixtures(directory=os.path.join(FIXTURE_DIR, "rss"), names=FEED_NAMES, items=25):
+    os.makedirs(directory, exist_ok=True)
+    for seed, name in enumerate(names):
+        write_rss_fixture(os.path.join(directory, f"{name}.xml"), name, items=items, seed=seed)
+
+def synthetic_ohlcv(index, seed, start_price=1.0, volatility=0.006):
+    """Deterministic random-walk OHLC bars, rounded like real quotes."""
+    rng = np.random.default_rng(seed)
+    close = start_price * np.exp(np.cumsum(rng.normal(0, volatility, len(index))))
+    open_ = np.concatenate([[start_price], close[:-1]])
+    spread = np.abs(rng.normal(0, volatility / 2, len(index))) * close
+    return pd.DataFrame({"Open": open_, "High": np.maximum(open_, close) + spread, "Low": np.minimum(open_, close) - spread,
+                         "Close": close, "Volume": 0}, index=index).round(5)
+
+def fx_session_hours(end, days):
+    """Hourly bars of the last `days` days without the FX weekend (Friday 21:00 to Sunday 21:00 UTC)."""
+    index = pd.date_range(end=end.floor("h"), periods=days * 24, freq="h")
+    weekend = (index.dayofweek == 5) | ((index.dayofweek == 4) & (index.hour >= 21)) | ((index.dayofweek == 6) & (index.hour < 21))
+    return index[~weekend]
+
+def make_ohlcv_fixtures(directory=OHLCV_DIR):
+    end = pd.Timestamp(FIXTURE_END).tz_localize(None)
+    provider = FileProvider(directory)
+    for interval, tickers, index in [("1d", DAILY_TICKERS, pd.bdate_range(end=end.normalize(), periods=DAILY_BARS)),
+                                     ("1h", HOURLY_TICKERS, fx_session_hours(end, HOURLY_DAYS))]:
+        frames = {t: synthetic_ohlcv(index, seed, start_price=1.0 + seed * 0.1, volatility=0.006 if interval == "1d" else 0.0015)
+                  for seed, t in enumerate(tickers)}
+        provider.record(pd.concat(frames, axis=1).swaplevel(axis=1), interval)
+
+def record_fixtures():
+    """Replaces the synthetic fixtures with live data from Yahoo Finance and the real RSS feeds."""
+    provider = FileProvider(OHLCV_DIR)
+    provider.record(YFinanceProvider().download(DAILY_TICKERS, period="1y", interval="1d"), "1d")
+    provider.record(YFinanceProvider().download(HOURLY_TICKERS, period="6mo", interval="1h"), "1h")
+    for name, url in sentiment_analysis.CURRENCY_RSS_FEEDS.items():
+        with urllib.request.urlopen(url, timeout=20) as response, open(os.path.join(FIXTURE_DIR, "rss", f"{name}.xml"), "wb") as f:
+            f.write(response.read())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the offline benchmark fixtures")
+    parser.add_argument("--record", action="store_true", help="record live data instead of generating synthetic fixtures")
+    if parser.parse_args().record:
+        record_fixtures()
+    else:
+        make_rss_fixtures()
+        make_ohlcv_fixtures()
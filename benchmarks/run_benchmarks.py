@@ -0,0 +1,166 @@
+# benchmarks/run_benchmarks.py - Offline per-stage benchmark of both analyzers on recorded fixtures
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import liquidity_analyzer
+import main as sentiment_analysis
+from benchmarks.fixture_server import FIXTURE_DIR, start_fixture_server
+from benchmarks.make_fixtures import FEED_NAMES, FIXTURE_END, OHLCV_DIR
+from indicators import IndicatorEngine
+from market_data import FileProvider, ticker_frame
+from news_fetcher import fetch_all_feeds
+from sentiment_cache import SentimentCache
+
+BENCHMARK_OUTPUT_FILE = "benchmark_results.json"
+SCALES = [1, 10, 100]
+STAGES = ["fetch_prices", "fetch_prices_1h", "resample", "fetch_feeds_cold", "fetch_feeds_warm", "sentiment_cold", "sentiment_warm",
+          "indicators_cold", "indicators_warm", "peak_detection", "plan_scoring", "timeframe_analysis", "output_writing"]
+
+@contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def build_scaled_fixtures(workdir, scale):
+    """
+    Copies the recorded fixtures `scale` times under new names (EURUSD_3=X, USD_3.xml, ...) with a
+    small price perturbation, so every scale runs the same code on proportionally more data.
+    """
+    rng = np.random.default_rng(scale)
+    provider = FileProvider(os.path.join(workdir, "ohlcv"))
+    for interval, period in [("1d", "1y"), (liquidity_analyzer.BASE_INTERVAL, "6mo")]:
+        base = FileProvider(OHLCV_DIR).download([s + "=X" for s in liquidity_analyzer.PRIMARY_SYMBOLS], period=period, interval=interval)
+        symbols, frames = [], {}
+        for k in range(scale):
+            for symbol in liquidity_analyzer.PRIMARY_SYMBOLS:
+                name = symbol if k == 0 else f"{symbol}_{k}"
+                frame = ticker_frame(base, symbol + "=X")
+                frames[name + "=X"] = frame * (1 + rng.normal(0, 1e-4, (len(frame), 1))) if k else frame
+                symbols.append(name)
+        provider.record(pd.concat(frames, axis=1).swaplevel(axis=1), interval)
+    for ticker in list(liquidity_analyzer.CORRELATION_SYMBOLS.values()) + sentiment_analysis.MARKET_TICKERS:
+        shutil.copy(os.path.join(OHLCV_DIR, "1d", f"{ticker}.csv"), os.path.join(workdir, "ohlcv", "1d"))
+    for ticker in liquidity_analyzer.CORRELATION_SYMBOLS.values():
+        shutil.copy(os.path.join(OHLCV_DIR, liquidity_analyzer.BASE_INTERVAL, f"{ticker}.csv"), os.path.join(workdir, "ohlcv", liquidity_analyzer.BASE_INTERVAL))
+
+    rss_dir = os.path.join(workdir, "rss")
+    os.makedirs(rss_dir, exist_ok=True)
+    feeds = {}
+    for k in range(scale):
+        for name in FEED_NAMES:
+            feed_name = name if k == 0 else f"{name}_{k}"
+            with open(os.path.join(FIXTURE_DIR, "rss", f"{name}.xml")) as f: xml = f.read()
+            with open(os.path.join(rss_dir, f"{feed_name}.xml"), "w") as f: f.write(xml.replace(f">{name}-", f">{feed_name}-"))
+            feeds[feed_name] = f"rss/{feed_name}.xml"
+    return symbols, feeds
+
+def run_pipeline(workdir, symbols, feeds):
+    timings = {}
+    tickers = [s + "=X" for s in symbols] + list(liquidity_analyzer.CORRELATION_SYMBOLS.values()) + sentiment_analysis.MARKET_TICKERS
+    with timed(timings, "fetch_prices"):
+        market_data = FileProvider(os.path.join(workdir, "ohlcv")).download(tickers, period="6mo")
+    # مسیر چند-بازه‌ای liquidity_analyzer: یک دریافت ساعتی و ساخت بقیه بازه‌ها با resample
+    with timed(timings, "fetch_prices_1h"):
+        hourly = FileProvider(os.path.join(workdir, "ohlcv")).download([s + "=X" for s in symbols] + list(liquidity_analyzer.CORRELATION_SYMBOLS.values()),
+                                                                      period="6mo", interval=liquidity_analyzer.BASE_INTERVAL)
+    with timed(timings, "resample"):
+        timeframes = liquidity_analyzer.build_timeframes(hourly)
+
+    server, base_url = start_fixture_server(directory=workdir)
+    try:
+        urls, feed_state = {name: f"{base_url}/{path}" for name, path in feeds.items()}, {}
+        with timed(timings, "fetch_feeds_cold"):
+            entries = fetch_all_feeds(urls, feed_state)
+        with timed(timings, "fetch_feeds_warm"):
+            fetch_all_feeds(urls, feed_state)
+    finally:
+        server.shutdown()
+    # سرخط‌های fixture قدیمی هستند؛ زمان انتشار را به اکنون منتقل می‌کنیم تا وزن زمانی صفر نشود
+    shift = time.time() - FIXTURE_END.timestamp()
+    entries = {name: [dict(e, published=e["published"] + shift) for e in items] for name, items in entries.items()}
+
+    cache = SentimentCache(os.path.join(workdir, "sentiment_cache.db"))
+    for stage in ["sentiment_cold", "sentiment_warm"]:
+        with timed(timings, stage):
+            scores = {name: sentiment_analysis.get_nlp_sentiment_for_feed(items, cache) for name, items in entries.items()}
+    cache.close()
+
+    engine = IndicatorEngine(os.path.join(workdir, "indicator_state.json"))
+    for stage in ["indicators_cold", "indicators_warm"]:
+        with timed(timings, stage):
+            context = liquidity_analyzer.get_market_context(market_data, engine)
+            indicators = {s: liquidity_analyzer.symbol_indicators(engine, market_data, s) for s in symbols}
+            sentiment_analysis.get_robust_market_regime(market_data, engine)
+            sentiment_analysis.get_leading_indicator_bias(market_data, engine)
+
+    analyses = {}
+    for symbol in symbols:
+        data = liquidity_analyzer.validate_and_standardize_data(ticker_frame(market_data, symbol + "=X"), symbol)
+        if data is None:
+            continue
+        with timed(timings, "peak_detection"):
+            main_trend, prominence = liquidity_analyzer.trend_and_prominence(data, indicators[symbol])
+            highs, lows = data['high'].to_numpy(), data['low'].to_numpy()
+            high_indices, low_indices = liquidity_analyzer.find_liquidity_peaks(highs, lows, prominence)
+        with timed(timings, "plan_scoring"):
+            analyses[symbol] = {"trade_plans": liquidity_analyzer.score_plans(highs, lows, high_indices, low_indices, main_trend, context, symbol)}
+
+    end_date = datetime.now()
+    with timed(timings, "timeframe_analysis"):
+        for timeframe, data in timeframes.items():
+            timeframe_context = liquidity_analyzer.get_market_context(data, timeframe=timeframe)
+            for symbol in symbols:
+                _, _, plans, _, _ = liquidity_analyzer.analyze_symbol(
+                    symbol, liquidity_analyzer.analysis_window(data, symbol, timeframe, end_date), timeframe_context, timeframe=timeframe)
+                if plans:
+                    analyses.setdefault(symbol, {"trade_plans": []})["trade_plans"].extend(plans)
+
+    with timed(timings, "output_writing"):
+        with open(os.path.join(workdir, liquidity_analyzer.OUTPUT_FILENAME), "w") as f: json.dump(analyses, f, indent=4)
+        with open(os.path.join(workdir, sentiment_analysis.OUTPUT_FILE), "w") as f: json.dump({"market_regime": "Neutral", "sentiments": scores}, f)
+        with open(os.path.join(workdir, sentiment_analysis.DASHBOARD_FILE), "w") as f:
+            f.write(sentiment_analysis.generate_dashboard_html({"master_control": "ACTIVE", "market_regime": "Neutral", "final_sentiments": scores}))
+    return timings
+
+def run_benchmarks(scales=SCALES, repeats=3):
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as setup_dir:
+            symbols, feeds = build_scaled_fixtures(setup_dir, scale)
+            best = {}
+            for _ in range(repeats):
+                with tempfile.TemporaryDirectory() as workdir:
+                    shutil.copytree(setup_dir, workdir, dirs_exist_ok=True)
+                    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                        timings = run_pipeline(workdir, symbols, feeds)
+                    for stage, seconds in timings.items():
+                        best[stage] = min(best.get(stage, seconds), seconds)
+        results.append({"scale": scale, "symbols": len(symbols), "feeds": len(feeds),
+                        "stages": {stage: best.get(stage, 0.0) for stage in STAGES},
+                        "total_seconds": sum(best.values())})
+        print(f"scale {scale:>3}x: " + ", ".join(f"{stage}={best.get(stage, 0.0):.4f}s" for stage in STAGES))
+    return {"generated_at": datetime.now().isoformat(), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "repeats": repeats, "results": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmark (best of N repeats per stage)")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=BENCHMARK_OUTPUT_FILE)
+    args = parser.parse_args()
+    output = run_benchmarks(args.scales, args.repeats)
+    with open(args.output, "w") as f: json.dump(output, f, indent=2)
+    print(f"Benchmark results saved to '{args.output}'")
@@ -0,0 +1,142 @@
+# indicators.py - Streaming indicator state (EMA, rolling mean/std) persisted between runs
+import json
+import math
+import os
+import pandas as pd
+
+# --- تنظیمات ---
+# کنار strategy_data.json ذخیره می‌شود
+INDICATOR_STATE_FILE = "indicator_state.json"
+
+class EMAState:
+    """Same recurrence as pandas `ewm(span=..., adjust=False)`."""
+    def __init__(self, span, value=None):
+        self.span = span
+        self.alpha = 2.0 / (span + 1.0)
+        self.value = value
+
+    def peek(self, x):
+        return x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+
+    def update(self, x):
+        self.value = self.peek(x)
+
+    def to_dict(self):
+        return {"value": self.value}
+
+class RollingState:
+    """
+    Fixed-window mean and sample std (ddof=1, like pandas `rolling`). A ring buffer holds the
+    window and Welford accumulators are updated on add/remove, so each bar costs O(1).
+    """
+    def __init__(self, window, buffer=None, pos=0, count=0, mean=0.0, m2=0.0):
+        self.window = window
+        self.buffer = buffer if buffer is not None else [0.0] * window
+        self.pos, self.count, self.mean, self.m2 = pos, count, mean, m2
+
+    def _next(self, x):
+        count, mean, m2 = self.count, self.mean, self.m2
+        if count == self.window:
+            # خروج قدیمی‌ترین مقدار از پنجره
+            old = self.buffer[self.pos]
+            count -= 1
+            if count == 0:
+                mean, m2 = 0.0, 0.0
+            else:
+                old_mean = mean
+                mean = (mean * (count + 1) - old) / count
+                m2 -= (old - old_mean) * (old - mean)
+        count += 1
+        delta = x - mean
+        mean += delta / count
+        m2 += delta * (x - mean)
+        return count, mean, max(m2, 0.0)
+
+    def peek(self, x):
+        """(mean, std) of the window if `x` were the next bar, without changing the state."""
+        count, mean, m2 = self._next(x)
+        if count < self.window:
+            return math.nan, math.nan
+        return mean, math.sqrt(m2 / (count - 1)) if count > 1 else math.nan
+
+    def update(self, x):
+        self.count, self.mean, self.m2 = self._next(x)
+        self.buffer[self.pos] = x
+        self.pos = (self.pos + 1) % self.window
+
+    def to_dict(self):
+        return {"buffer": self.buffer, "pos": self.pos, "count": self.count, "mean": self.mean, "m2": self.m2}
+
+def _new_state(kind, param):
+    return EMAState(param) if kind == "ema" else RollingState(param)
+
+def _state_from_dict(kind, param, data):
+    return EMAState(param, **data) if kind == "ema" else RollingState(param, **data)
+
+class IndicatorEngine:
+    """
+    Keeps indicator state per series key (e.g. "EURUSD=X:1d:Close"). State covers every bar up to
+    the second-to-last one; the newest bar may still be forming, so it is only peeked, never committed.
+    When the stored last bar is missing from the incoming history (a gap) the state is rebuilt.
+
+    `specs` maps an output name to (kind, parameter), kind being "ema", "sma" or "std":
+    {"trend_ema": ("ema", 200), "std": ("std", 85)}
+    """
+    def __init__(self, path=INDICATOR_STATE_FILE):
+        self.path = path
+        self.states = {}
+        self.dirty = set()
+        try:
+            with open(path, "r") as f: self.states = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def update(self, key, series, specs):
+        series = series.dropna()
+        if series.empty:
+            return {name: math.nan for name in specs}
+        values, index = series.to_numpy(dtype=float), series.index
+        stored = self.states.get(key)
+        spec_key = sorted([name, kind, param] for name, (kind, param) in specs.items())
+        start = 0
+        if stored and stored.get("specs") == spec_key:
+            last = int(index.searchsorted(pd.Timestamp(stored["last_ts"])))
+            if last < len(index) - 1 and index[last] == pd.Timestamp(stored["last_ts"]):
+                start = last + 1
+            else:
+                stored = None
+        else:
+            stored = None
+        if stored is None:
+            print(f"Indicators: rebuilding {key} from {len(index)} bars")
+            states = {name: _new_state(kind, param) for name, (kind, param) in specs.items()}
+        else:
+            states = {name: _state_from_dict(kind, param, stored["indicators"][name]) for name, (kind, param) in specs.items()}
+
+        for x in values[start:-1]:
+            for state in states.values():
+                state.update(x)
+        if len(values) > 1 and (stored is None or start < len(values) - 1):
+            self.states[key] = {"last_ts": pd.Timestamp(index[-2]).isoformat(),
+                                "specs": spec_key,
+                                "indicators": {name: state.to_dict() for name, state in states.items()}}
+            self.dirty.add(key)
+
+        result = {}
+        for name, (kind, param) in specs.items():
+            peeked = states[name].peek(values[-1])
+            result[name] = peeked if kind == "ema" else peeked[0] if kind == "sma" else peeked[1]
+        return result
+
+    def save(self):
+        """Merges this run's series into the state file on disk and replaces it atomically."""
+        if not self.dirty:
+            return
+        try:
+            with open(self.path, "r") as f: merged = json.load(f)
+        except (FileNotFoundError, ValueError):
+            merged = {}
+        merged.update({key: self.states[key] for key in self.dirty})
+        with open(self.path + ".tmp", "w") as f: json.dump(merged, f)
+        os.replace(self.path + ".tmp", self.path)
+        self.dirty.clear()
@@ -0,0 +1,139 @@
+# level_index.py - Persistent per-symbol index of clustered liquidity levels (sorted arrays, binary-search lookups)
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# --- تنظیمات ---
+LEVEL_INDEX_DIR = "level_index"
+LEVELS_OUTPUT_FILE = "liquidity_levels.json"
+ATR_PERIOD = 14
+# قله‌هایی که فاصله‌شان کمتر از این ضریب ATR باشد در یک ناحیه ادغام می‌شوند
+ZONE_ATR_TOLERANCE = 0.5
+# find_peaks با distance=5 قله‌های ۵ میله آخر را هنوز قطعی نمی‌داند؛ این میله‌ها در اجرای بعدی ثبت می‌شوند
+CONFIRMATION_BARS = 5
+# نواحی که این مدت لمس نشده‌اند از شاخص حذف می‌شوند
+MAX_LEVEL_AGE_DAYS = 365
+ARRAY_FIELDS = ["price", "low", "high", "touches", "last_touch", "kind"]
+SUPPORT, RESISTANCE, BOTH = -1, 1, 0
+
+def average_true_range(highs, lows, closes, period=ATR_PERIOD):
+    prev_close = np.concatenate([[closes[0]], closes[:-1]])
+    true_range = np.maximum(highs - lows, np.maximum(np.abs(highs - prev_close), np.abs(lows - prev_close)))
+    return float(true_range[-period:].mean())
+
+def empty_levels():
+    return {"price": np.empty(0), "low": np.empty(0), "high": np.empty(0), "touches": np.empty(0, dtype=np.int64),
+            "last_touch": np.empty(0, dtype=np.int64), "kind": np.empty(0, dtype=np.int8)}
+
+def merge_levels(levels, tolerance):
+    """
+    Single-pass clustering of price-sorted zones: neighbours whose gap is within `tolerance`
+    are merged into one zone (touch-weighted price, union of bounds, summed touches).
+    """
+    order = np.argsort(levels["price"], kind="stable")
+    levels = {name: values[order] for name, values in levels.items()}
+    if len(order) < 2:
+        return levels
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(levels["price"]) > tolerance]))
+    touches = np.add.reduceat(levels["touches"], starts)
+    has_support = np.logical_or.reduceat(levels["kind"] <= 0, starts)
+    has_resistance = np.logical_or.reduceat(levels["kind"] >= 0, starts)
+    return {
+        "price": np.add.reduceat(levels["price"] * levels["touches"], starts) / touches,
+        "low": np.minimum.reduceat(levels["low"], starts),
+        "high": np.maximum.reduceat(levels["high"], starts),
+        "touches": touches,
+        "last_touch": np.maximum.reduceat(levels["last_touch"], starts),
+        # ناحیه‌ای که هم از سقف‌ها و هم از کف‌ها ساخته شده، هر دو نقش را دارد
+        "kind": np.where(has_support & has_resistance, BOTH, np.where(has_resistance, RESISTANCE, SUPPORT)).astype(np.int8),
+    }
+
+class LevelIndex:
+    """
+    One `<symbol>_<interval>.npz` per series with the zones sorted by price, plus the timestamp
+    up to which peaks were already merged, so each run only adds peaks confirmed since then.
+    """
+    def __init__(self, directory=LEVEL_INDEX_DIR):
+        self.directory = directory
+
+    def _path(self, symbol, interval):
+        return os.path.join(self.directory, f"{symbol}_{interval}.npz")
+
+    def load(self, symbol, interval="1d"):
+        """(levels, confirmed_until_ns); empty levels and None when the symbol is not indexed yet."""
+        try:
+            with np.load(self._path(symbol, interval)) as stored:
+                return {name: stored[name] for name in ARRAY_FIELDS}, int(stored["confirmed_until"])
+        except (FileNotFoundError, KeyError, ValueError):
+            return empty_levels(), None
+
+    def save(self, symbol, interval, levels, confirmed_until):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(symbol, interval)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, confirmed_until=np.int64(confirmed_until), **levels)
+        os.replace(path + ".tmp", path)
+
+    def update(self, symbol, data, high_indices, low_indices, interval="1d"):
+        """
+        Merges the peaks confirmed since the last run into the symbol's zones. `data` is the
+        standardized frame (high/low/close) the peak indices refer to. Returns the levels.
+        """
+        levels, confirmed_until = self.load(symbol, interval)
+        ts = pd.DatetimeIndex(data.index).as_unit("ns").asi8
+        highs, lows = data['high'].to_numpy(), data['low'].to_numpy()
+        cutoff = len(ts) - CONFIRMATION_BARS
+        if cutoff <= 0:
+            return levels
+        indices = np.concatenate([high_indices, low_indices]).astype(np.int64)
+        prices = np.concatenate([highs[high_indices], lows[low_indices]])
+        kinds = np.concatenate([np.full(len(high_indices), RESISTANCE), np.full(len(low_indices), SUPPORT)]).astype(np.int8)
+        new = indices < cutoff
+        if confirmed_until is not None:
+            new &= ts[indices] > confirmed_until
+        if new.any():
+            levels = {
+                "price": np.concatenate([levels["price"], prices[new]]),
+                "low": np.concatenate([levels["low"], prices[new]]),
+                "high": np.concatenate([levels["high"], prices[new]]),
+                "touches": np.concatenate([levels["touches"], np.ones(int(new.sum()), dtype=np.int64)]),
+                "last_touch": np.concatenate([levels["last_touch"], ts[indices[new]]]),
+                "kind": np.concatenate([levels["kind"], kinds[new]]),
+            }
+            tolerance = ZONE_ATR_TOLERANCE * average_true_range(highs, lows, data['close'].to_numpy())
+            levels = merge_levels(levels, tolerance)
+        max_age = ts[-1] - np.int64(MAX_LEVEL_AGE_DAYS * 86400 * 10**9)
+        keep = levels["last_touch"] >= max_age
+        levels = {name: values[keep] for name, values in levels.items()}
+        self.save(symbol, interval, levels, ts[cutoff - 1] if confirmed_until is None else max(ts[cutoff - 1], confirmed_until))
+        return levels
+
+def nearest_levels(levels, price, n=1):
+    """
+    The `n` zones just below and just above `price` (binary search on the sorted prices).
+    Returns (below, above) as lists of row indices into the level arrays, nearest first.
+    """
+    i = int(np.searchsorted(levels["price"], price))
+    return list(range(i - 1, max(i - n, 0) - 1, -1)), list(range(i, min(i + n, len(levels["price"]))))
+
+def _levels_json(levels):
+    return {
+        "price": [round(float(p), 5) for p in levels["price"]],
+        "low": [round(float(p), 5) for p in levels["low"]],
+        "high": [round(float(p), 5) for p in levels["high"]],
+        "touches": levels["touches"].tolist(),
+        "last_touch": [pd.Timestamp(int(t)).strftime("%Y.%m.%d %H:%M") for t in levels["last_touch"]],
+        "kind": ["BOTH" if k == BOTH else "RESISTANCE" if k == RESISTANCE else "SUPPORT" for k in levels["kind"]],
+    }
+
+def export_levels(all_levels, path=LEVELS_OUTPUT_FILE):
+    """
+    Writes {symbol: {timeframe: {field: [...]}}} with every field as a price-sorted array, so a
+    consumer can bisect `price` and read the other fields at the same position.
+    """
+    output = {}
+    for symbol, timeframes in all_levels.items():
+        output[symbol] = {timeframe: _levels_json(levels) for timeframe, levels in timeframes.items()}
+    with open(path + ".tmp", "w") as f: json.dump(output, f, indent=2)
+    os.replace(path + ".tmp", path)
@@ -1,13 +1,21 @@
 # multi_currency_final_corrected.py
 # Copyright 2025, Gemini AI - Final Corrected Logic Version
 
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from scipy.signal import find_peaks
 from datetime import datetime, timedelta
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+from market_data import ticker_frame, resample_ohlc
+from price_store import fetch_with_store, FETCH_DEADLINE_SECONDS
+from indicators import IndicatorEngine
+from level_index import LevelIndex, export_levels
+import metrics
 
 # --- تنظیمات ---
 # نام نمادها را برای سادگی در کد، بدون "=X" نگه می‌داریم
@@ -16,7 +24,27 @@ CORRELATION_SYMBOLS = {"DXY": "DX-Y.NYB"}
 LOOKBACK_DAYS = 120
 EMA_PERIOD = 50
 TOP_N_PLANS_PER_SYMBOL = 2
+TREND_EMA_PERIOD = 200
+# پنجره انحراف معیار برای prominence؛ تقریبا تعداد روزهای معاملاتی در LOOKBACK_DAYS
+PROMINENCE_STD_WINDOW = LOOKBACK_DAYS * 5 // 7
 OUTPUT_FILENAME = "multi_currency_analysis.json"
+# تعداد پردازه‌ها برای تحلیل موازی نمادها (۱ = اجرای ترتیبی مانند قبل)
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "1"))
+SHARED_FIELDS = ["high", "low", "close"]
+WORKER_CONTEXT = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+if WORKER_CONTEXT.get_start_method() == "forkserver":
+    # کتابخانه‌های سنگین یک بار در سرور fork بارگذاری می‌شوند، نه در هر پردازه
+    WORKER_CONTEXT.set_forkserver_preload(["pandas", "scipy.signal"])
+# همه نمادها فقط یک بار با کوچک‌ترین بازه (۱ ساعته) دریافت و بقیه بازه‌ها به صورت محلی ساخته می‌شوند
+BASE_INTERVAL = "1h"
+# بازه زمانی -> قاعده resample (None یعنی خود داده پایه)؛ ترتیب همان ترتیب پلن‌ها در خروجی است
+TIMEFRAMES = {"1d": "1D", "4h": "4h", "1h": None}
+# میله‌های روزانه/۴ساعته از بسته شدن نیویورک (21:00 UTC) شروع می‌شوند، نه نیمه‌شب UTC؛ بدون میله ناقص یکشنبه
+SESSION_OFFSET = "3h"
+# دوره‌هایی که کمتر از این نسبت از میله‌های ساعتی مورد انتظار را دارند (تعطیلات، داده ناقص) حذف می‌شوند
+MIN_PERIOD_FILL = 0.5
+# پنجره جستجوی قله‌ها در هر بازه؛ اندیکاتورها روی کل سری محاسبه می‌شوند
+TIMEFRAME_LOOKBACK_DAYS = {"1d": LOOKBACK_DAYS, "4h": 40, "1h": 10}
 
 def validate_and_standardize_data(data, symbol_name):
     if data is None or data.empty: return None
@@ -27,127 +55,275 @@ def validate_and_standardize_data(data, symbol_name):
     if len(data) < EMA_PERIOD: return None
     return data
 
-def get_market_context(start, end):
+def get_market_context(market_data, engine=None, timeframe="1d"):
     context = {}
-    print("Analyzing market context...")
+    print(f"Analyzing market context ({timeframe})...")
     for name, ticker in CORRELATION_SYMBOLS.items():
         try:
-            data = yf.download(ticker, start=start, end=end, progress=False, timeout=20)
-            data = validate_and_standardize_data(data, name)
+            data = validate_and_standardize_data(ticker_frame(market_data, ticker), name)
             if data is not None:
-                data['ema'] = data['close'].ewm(span=EMA_PERIOD, adjust=False).mean()
-                context[name] = "Bullish" if data['close'].iloc[-1] > data['ema'].iloc[-1] else "Bearish"
-        except Exception: context[name] = "Unknown"
+                if engine is not None:
+                    ema = engine.update(f"{ticker}:{timeframe}:close", data['close'], {"ema": ("ema", EMA_PERIOD)})["ema"]
+                else:
+                    ema = data['close'].ewm(span=EMA_PERIOD, adjust=False).mean().iloc[-1]
+                context[name] = "Bullish" if data['close'].iloc[-1] > ema else "Bearish"
+        except Exception as e:
+            context[name] = "Unknown"
+            metrics.fallback(f"context:{name}", e)
     print(f"Market Context: {context}")
     return context
 
-# +++ تابع تحلیل با منطق اصلاح شده +++
-def generate_analysis(data, context, symbol_name):
-    data['trend_ema'] = data['close'].ewm(span=200, adjust=False).mean()
-    main_trend = "Up" if data['close'].iloc[-1] > data['trend_ema'].iloc[-1] else "Down"
-    prominence_threshold = data['close'].std() * 0.6
-    plans = []
-    
+def trend_and_prominence(data, indicators=None):
+    """
+    Main trend (close vs 200 EMA) and the find_peaks prominence threshold of one symbol.
+    `indicators` ({"trend_ema", "std"}) comes from the incremental engine; missing values are computed from `data`.
+    """
+    close = data['close']
+    indicators = indicators or {}
+    trend_ema = indicators.get("trend_ema")
+    if trend_ema is None or np.isnan(trend_ema):
+        trend_ema = close.ewm(span=TREND_EMA_PERIOD, adjust=False).mean().iloc[-1]
+    close_std = indicators.get("std")
+    if close_std is None or np.isnan(close_std):
+        close_std = close.std()
+    main_trend = "Up" if close.iloc[-1] > trend_ema else "Down"
+    return main_trend, close_std * 0.6
+
+def find_liquidity_peaks(highs, lows, prominence_threshold):
+    # در حالت موازی این زمان‌ها در پردازه‌های کارگر ثبت می‌شوند و فقط زمان کل analyze_symbols باقی می‌ماند
+    with metrics.stage("find_peaks"):
+        high_indices, _ = find_peaks(highs, prominence=prominence_threshold, distance=5)
+        low_indices, _ = find_peaks(-lows, prominence=prominence_threshold, distance=5)
+    return high_indices, low_indices
+
+def score_plans(highs, lows, high_indices, low_indices, main_trend, context, symbol_name, top_n=TOP_N_PLANS_PER_SYMBOL, timeframe="1d"):
+    """
+    Scores every peak with array operations and builds plan dicts only for the top_n emitted plans.
+    Returns the plans already sorted by confidence (ties keep SELL-then-BUY, oldest-first order).
+    """
     # === ویژگی جدید: دریافت زمان فعلی برای timestamp ===
     now_str = datetime.now().strftime("%Y.%m.%d %H:%M")
     
-    high_indices, _ = find_peaks(data['high'].to_numpy(), prominence=prominence_threshold, distance=5)
-    for idx in high_indices:
-        peak = data.iloc[idx]
-        score = 50
-        thesis = f"Sell Plan @ {peak['high']:.5f}. "
-        if main_trend == "Down":
-            score += 25
-            thesis += "Pro-Trend. "
-        
-        # === منطق جدید و صحیح برای DXY ===
-        # اگر USD ارز دوم است (مثل EURUSD)، فروش یعنی خرید دلار -> با DXY صعودی تایید می‌شود
-        if "USD" in symbol_name[3:] and context.get("DXY") == "Bullish":
-            score += 25
-            thesis += "DXY Confirms. "
-        # اگر USD ارز اول است (مثل USDCAD)، فروش یعنی فروش دلار -> با DXY نزولی تایید می‌شود
-        elif "USD" in symbol_name[:3] and context.get("DXY") == "Bearish":
-            score += 25
-            thesis += "DXY Confirms. "
+    is_sell = np.concatenate([np.ones(len(high_indices), dtype=bool), np.zeros(len(low_indices), dtype=bool)])
+    prices = np.concatenate([highs[high_indices], lows[low_indices]])
+    if len(prices) == 0:
+        return []
 
-        plans.append({
-            "type": "SELL",
-            "price": peak['high'],
-            "confidence_score": min(score, 100),
-            "timestamp": now_str, # << ویژگی جدید اضافه شد
-            "trade_thesis": thesis
-        })
+    # === منطق DXY ===
+    # اگر USD ارز دوم است (مثل EURUSD)، فروش یعنی خرید دلار -> با DXY صعودی تایید می‌شود و خرید با DXY نزولی
+    # اگر USD ارز اول است (مثل USDCAD)، فروش یعنی فروش دلار -> با DXY نزولی تایید می‌شود و خرید با DXY صعودی
+    usd_quote, usd_base, dxy = "USD" in symbol_name[3:], "USD" in symbol_name[:3], context.get("DXY")
+    sell_dxy = (usd_quote and dxy == "Bullish") or (usd_base and dxy == "Bearish")
+    buy_dxy = (usd_quote and dxy == "Bearish") or (usd_base and dxy == "Bullish")
+
+    pro_trend = np.where(is_sell, main_trend == "Down", main_trend == "Up")
+    dxy_confirms = np.where(is_sell, sell_dxy, buy_dxy)
+    scores = np.minimum(50 + 25 * pro_trend + 25 * dxy_confirms, 100)
 
-    low_indices, _ = find_peaks(-data['low'].to_numpy(), prominence=prominence_threshold, distance=5)
-    for idx in low_indices:
-        peak = data.iloc[idx]
-        score = 50
-        thesis = f"Buy Plan @ {peak['low']:.5f}. "
-        if main_trend == "Up":
-            score += 25
-            thesis += "Pro-Trend. "
-            
-        # === منطق جدید و صحیح برای DXY ===
-        # اگر USD ارز دوم است (مثل EURUSD)، خرید یعنی فروش دلار -> با DXY نزولی تایید می‌شود
-        if "USD" in symbol_name[3:] and context.get("DXY") == "Bearish":
-            score += 25
-            thesis += "DXY Confirms. "
-        # اگر USD ارز اول است (مثل USDCAD)، خرید یعنی خرید دلار -> با DXY صعودی تایید می‌شود
-        elif "USD" in symbol_name[:3] and context.get("DXY") == "Bullish":
-            score += 25
-            thesis += "DXY Confirms. "
+    # انتخاب top-N با argpartition؛ کلید ترتیب همان sort پایدار قبلی را بازسازی می‌کند
+    order_key = -scores * (len(scores) + 1) + np.arange(len(scores))
+    k = min(top_n, len(scores))
+    selected = np.argpartition(order_key, k - 1)[:k]
+    selected = selected[np.argsort(order_key[selected])]
 
+    plans = []
+    for i in selected:
+        thesis = f"{'Sell' if is_sell[i] else 'Buy'} Plan @ {prices[i]:.5f}. "
+        if pro_trend[i]: thesis += "Pro-Trend. "
+        if dxy_confirms[i]: thesis += "DXY Confirms. "
         plans.append({
-            "type": "BUY",
-            "price": peak['low'],
-            "confidence_score": min(score, 100),
+            "type": "SELL" if is_sell[i] else "BUY",
+            "price": float(prices[i]),
+            "confidence_score": int(scores[i]),
             "timestamp": now_str, # << ویژگی جدید اضافه شد
+            "timeframe": timeframe,
             "trade_thesis": thesis
         })
     return plans
 
-def main():
+# +++ تابع تحلیل با منطق اصلاح شده (نسخه برداری با NumPy) +++
+def generate_analysis(data, context, symbol_name, top_n=TOP_N_PLANS_PER_SYMBOL, indicators=None, timeframe="1d"):
+    """(plans, peaks); peaks is (high_indices, low_indices, bars) so the level index can reuse them."""
+    main_trend, prominence_threshold = trend_and_prominence(data, indicators)
+    highs, lows = data['high'].to_numpy(), data['low'].to_numpy()
+    high_indices, low_indices = find_liquidity_peaks(highs, lows, prominence_threshold)
+    plans = score_plans(highs, lows, high_indices, low_indices, main_trend, context, symbol_name, top_n, timeframe)
+    return plans, (high_indices, low_indices, len(data))
+
+def symbol_indicators(engine, market_data, symbol, timeframe="1d"):
+    """Trend EMA and prominence std of one symbol on one timeframe from the incremental indicator engine."""
+    try:
+        close = ticker_frame(market_data, symbol + "=X").dropna(subset=['High', 'Low', 'Close'])['Close']
+        specs = {"trend_ema": ("ema", TREND_EMA_PERIOD), "std": ("std", PROMINENCE_STD_WINDOW)}
+        return engine.update(f"{symbol}=X:{timeframe}:close", close, specs)
+    except Exception:
+        return None
+
+def build_timeframes(market_data):
+    """{timeframe: (field, ticker) frame}, every timeframe resampled from the one base-interval download."""
+    return {timeframe: market_data if rule is None else resample_ohlc(market_data, rule, SESSION_OFFSET, MIN_PERIOD_FILL)
+            for timeframe, rule in TIMEFRAMES.items()}
+
+def analysis_window(data, symbol, timeframe, end_date):
+    """The symbol's bars inside the timeframe's peak-search lookback, or None."""
+    frame = ticker_frame(data, symbol + "=X")
+    if frame is None:
+        return None
+    return frame.loc[frame.index >= pd.Timestamp(end_date - timedelta(days=TIMEFRAME_LOOKBACK_DAYS[timeframe]))]
+
+def analyze_symbol(symbol, data, context, indicators=None, timeframe="1d"):
+    """
+    Validation, EMA, peak detection and plan scoring for one symbol on one timeframe.
+    Returns (symbol, timeframe, plans, peaks, error); peaks as in generate_analysis.
+    """
+    try:
+        data = validate_and_standardize_data(data, symbol)
+        if data is None:
+            return symbol, timeframe, None, None, None
+        # نام نماد (بدون "=X") به تابع تحلیل ارسال می‌شود؛ خروجی از قبل مرتب و محدود به top-N است
+        plans, peaks = generate_analysis(data, context, symbol, indicators=indicators, timeframe=timeframe)
+        return symbol, timeframe, plans, peaks, None
+    except Exception as e:
+        return symbol, timeframe, None, None, str(e)
+
+def index_symbol_levels(level_index, data, symbol, peaks, timeframe="1d"):
+    """
+    Adds the symbol's newly confirmed peaks on one timeframe to its persistent level index; returns
+    the zones. `peaks` comes from analyze_symbol on the same window, so no peak search is repeated.
+    """
+    data = validate_and_standardize_data(data, symbol)
+    if data is None:
+        return None
+    high_indices, low_indices, bars = peaks
+    if bars != len(data):
+        raise ValueError(f"peaks were found on {bars} bars, window has {len(data)}")
+    return level_index.update(symbol, data, high_indices, low_indices, interval=timeframe)
+
+# --- اجرای موازی: قیمت‌ها یک بار در shared memory نوشته می‌شوند و پردازه‌ها فقط برش‌ها را می‌خوانند ---
+_shared_block = None
+_shared_prices = None
+
+def _attach_shared_prices(name, shape):
+    global _shared_block, _shared_prices
+    _shared_block = shared_memory.SharedMemory(name=name)
+    _shared_prices = np.ndarray(shape, dtype=np.float64, buffer=_shared_block.buf)
+
+def _analyze_shared_symbol(task):
+    symbol, timeframe, offset, length, context, indicators = task
+    view = _shared_prices[:, offset:offset + length]
+    # زمان‌بندی مراحل داخل پردازه (find_peaks و ...) همراه نتیجه به پردازه اصلی برمی‌گردد
+    worker_metrics = metrics.start_run("liquidity_worker")
+    result = analyze_symbol(symbol, pd.DataFrame(view.T, columns=SHARED_FIELDS, copy=False), context, indicators, timeframe)
+    return result, worker_metrics.stages
+
+def analyze_symbols_parallel(jobs, workers):
+    """
+    Runs analyze_symbol for every (symbol, timeframe, frame, context, indicators) job in a process
+    pool. High/low/close of all jobs are packed into one shared-memory block, so no DataFrame is
+    pickled to the workers.
+    """
+    jobs = [job for job in jobs if job[2] is not None]
+    total = sum(len(job[2]) for job in jobs)
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(SHARED_FIELDS) * total * 8))
+    try:
+        prices = np.ndarray((len(SHARED_FIELDS), total), dtype=np.float64, buffer=block.buf)
+        tasks, offset = [], 0
+        for symbol, timeframe, frame, context, indicators in jobs:
+            prices[:, offset:offset + len(frame)] = frame.reindex(columns=[f.capitalize() for f in SHARED_FIELDS]).to_numpy(dtype=np.float64).T
+            tasks.append((symbol, timeframe, offset, len(frame), context, indicators))
+            offset += len(frame)
+        # forkserver/spawn: a forked worker could inherit a lock (metrics, price store) held by another thread
+        with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT, initializer=_attach_shared_prices, initargs=(block.name, prices.shape)) as pool:
+            results = []
+            for result, stages in pool.map(_analyze_shared_symbol, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+                metrics.merge_stages(stages)
+                results.append(result)
+        del prices
+    finally:
+        block.close()
+        block.unlink()
+    return results
+
+def main(workers=ANALYSIS_WORKERS):
+    metrics.start_run("liquidity")
     print("--- Starting Corrected Multi-Currency Analysis ---")
     end_date = datetime.now()
     start_date = end_date - timedelta(days=LOOKBACK_DAYS)
     
-    market_context = get_market_context(start_date, end_date)
-    all_analyses = {}
+    # همه نمادها و DXY در یک درخواست دسته‌ای ۱ ساعته دریافت می‌شوند؛ فقط میله‌های جدید از اینترنت گرفته می‌شوند
+    tickers = [symbol + "=X" for symbol in PRIMARY_SYMBOLS] + list(CORRELATION_SYMBOLS.values())
+    try:
+        # اگر دانلود تا مهلت تمام نشود، تحلیل با میله‌های ذخیره‌شده ادامه می‌یابد و نماد stale علامت می‌خورد
+        market_data = fetch_with_store(tickers, start=start_date, end=end_date, interval=BASE_INTERVAL, deadline=FETCH_DEADLINE_SECONDS)
+    except Exception as e:
+        print(f"ERROR while fetching market data: {e}")
+        metrics.fallback("market_data", e)
+        market_data = pd.DataFrame()
+    stale = set(market_data.attrs.get("stale", []))
+    with metrics.stage("resample"):
+        timeframes = build_timeframes(market_data)
 
-    for symbol in PRIMARY_SYMBOLS:
-        print(f"\n--- Analyzing {symbol} ---")
-        try:
-            # تیکر یاهو فایننس "=X" را برای دانلود اضافه می‌کنیم
-            ticker = symbol + "=X"
-            primary_data = yf.download(ticker, start=start_date, end=end_date, progress=False, timeout=20)
-            primary_data = validate_and_standardize_data(primary_data, symbol)
-            
-            if primary_data is None:
-                continue
+    # اندیکاتورها برای هر نماد و هر بازه به صورت افزایشی به‌روز می‌شوند (وضعیت در indicator_state.json)
+    engine = IndicatorEngine()
+    with metrics.stage("indicators"):
+        market_context = {tf: get_market_context(data, engine, tf) for tf, data in timeframes.items()}
+        indicators = {(symbol, tf): symbol_indicators(engine, data, symbol, tf) for tf, data in timeframes.items() for symbol in PRIMARY_SYMBOLS}
+    engine.save()
+    all_analyses = {}
 
-            # نام نماد (بدون "=X") به تابع تحلیل ارسال می‌شود
-            potential_plans = generate_analysis(primary_data, market_context, symbol)
-            
-            potential_plans.sort(key=lambda x: x['confidence_score'], reverse=True)
-            
-            top_plans_for_this_symbol = potential_plans[:TOP_N_PLANS_PER_SYMBOL]
-            
-            # نام تمیز نماد در خروجی استفاده می‌شود
-            all_analyses[symbol] = {"trade_plans": top_plans_for_this_symbol}
-            print(f"Analysis for {symbol} complete. Top {len(top_plans_for_this_symbol)} plans selected.")
+    jobs = [(symbol, tf, analysis_window(data, symbol, tf, end_date), market_context[tf], indicators[(symbol, tf)])
+            for symbol in PRIMARY_SYMBOLS for tf, data in timeframes.items()]
+    with metrics.stage("analyze_symbols"):
+        if workers > 1:
+            print(f"Analyzing {len(PRIMARY_SYMBOLS)} symbols x {len(TIMEFRAMES)} timeframes on {workers} worker processes...")
+            results = analyze_symbols_parallel(jobs, workers)
+        else:
+            results = [analyze_symbol(symbol, frame, context, ind, tf) for symbol, tf, frame, context, ind in jobs]
+    peaks = {}
+    for symbol, timeframe, top_plans_for_this_symbol, symbol_peaks, error in results:
+        print(f"\n--- Analyzing {symbol} ({timeframe}) ---")
+        if error is not None:
+            print(f"ERROR while processing {symbol} ({timeframe}): {error}")
+            metrics.fallback(f"symbol:{symbol}:{timeframe}", error)
+            continue
+        if top_plans_for_this_symbol is None:
+            continue
+        peaks[(symbol, timeframe)] = symbol_peaks
+        # نام تمیز نماد در خروجی استفاده می‌شود؛ پلن‌های همه بازه‌ها (هر کدام با فیلد timeframe) کنار هم قرار می‌گیرند
+        analysis = all_analyses.setdefault(symbol, {"trade_plans": [], "stale": symbol + "=X" in stale})
+        analysis["trade_plans"].extend(top_plans_for_this_symbol)
+        print(f"Analysis for {symbol} ({timeframe}) complete. Top {len(top_plans_for_this_symbol)} plans selected.")
 
-        except Exception as e:
-            print(f"ERROR while processing {symbol}: {e}")
+    # نواحی نقدینگی خوشه‌بندی‌شده (قله‌های نزدیک ادغام شده) به صورت آرایه‌های مرتب در liquidity_levels.json
+    level_index, all_levels = LevelIndex(), {}
+    with metrics.stage("level_index"):
+        # همان پنجره و قله‌هایی که در تحلیل پیدا شدند؛ find_peaks دوباره اجرا نمی‌شود
+        for symbol, tf, frame, _, _ in jobs:
+            if (symbol, tf) not in peaks:
+                continue
+            try:
+                levels = index_symbol_levels(level_index, frame, symbol, peaks[(symbol, tf)], tf)
+                if levels is not None:
+                    all_levels.setdefault(symbol, {})[tf] = levels
+            except Exception as e:
+                print(f"ERROR while indexing levels of {symbol} ({tf}): {e}")
+                metrics.fallback(f"levels:{symbol}:{tf}", e)
+        export_levels(all_levels)
 
     # ساختار نهایی خروجی JSON (بدون تغییر)
     # توجه: ساختار فایل خروجی را تغییر ندادم تا با ربات فعلی شما سازگار بماند
-    # ربات شما باید داخل کلید اصلی هر ارز به دنبال "trade_plans" بگردد
+    # کلید "stale" کنار "trade_plans" فقط اضافه شده است: true یعنی قیمت‌ها تا مهلت به‌روز نشدند و میله‌های ذخیره‌شده استفاده شدند
+    # ربات شما باید داخل کلید اصلی هر ارز به دنبال "trade_plans" بگردد؛ پلن‌های روزانه مانند قبل اول می‌آیند
     final_json_data = all_analyses 
     
-    with open(OUTPUT_FILENAME, 'w') as f:
-        json.dump(final_json_data, f, indent=4)
+    with metrics.stage("write_outputs", OUTPUT_FILENAME):
+        with open(OUTPUT_FILENAME, 'w') as f:
+            json.dump(final_json_data, f, indent=4)
         
     print(f"\n--- Multi-currency analysis complete. Results for all symbols saved to '{OUTPUT_FILENAME}' ---")
+    metrics.finish_run()
 
 if __name__ == "__main__":
-    main()
+    # python liquidity_analyzer.py --workers 8
+    with metrics.profiled("liquidity"):
+        main(int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else ANALYSIS_WORKERS)
@@ -1,21 +1,32 @@
 # main.py (The Ultimate Comprehensive Version: V2 with NLP and Advanced Indicators)
 import json
-import feedparser
-from datetime import datetime, timezone, timedelta
+import os
 import time
-import yfinance as yf
+from datetime import datetime, timezone, timedelta
+import numpy as np
 import pandas as pd
 # --- کتابخانه جدید برای تحلیل احساسات با NLP ---
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from news_fetcher import fetch_all_feeds, load_feed_state, save_feed_state, FEED_DEADLINE_SECONDS
+from sentiment_cache import SentimentCache
+from market_data import column
+from price_store import fetch_with_store, FETCH_DEADLINE_SECONDS
+from indicators import IndicatorEngine
+import metrics
 
 # --- فایل‌های حافظه و کنترل ---
 MEMORY_FILE = "strategy_data.json"
 CONTROL_FILE = "control.json"
 OUTPUT_FILE = "sentiment.txt"
 DASHBOARD_FILE = "dashboard.html"
+# هر پیش‌بینی و نتیجه بررسی آن یک خط جدید در این فایل است (فقط اضافه می‌شود، هرگز بازنویسی نمی‌شود)
+PREDICTION_LEDGER_FILE = "prediction_ledger.jsonl"
 
 # --- دیکشنری فیدهای RSS و جفت ارزها ---
 CURRENCY_RSS_FEEDS = {'USD':"https://www.investing.com/rss/news_1.rss",'EUR':"https://www.investing.com/rss/news_4.rss",'GBP':"https://www.investing.com/rss/news_6.rss",'JPY':"https://www.investing.com/rss/news_3.rss",'NZD':"https://www.rnz.co.nz/rss/business.xml",'CAD':"https://www.investing.com/rss/news_10.rss",'AUD':"https://www.investing.com/rss/news_8.rss",'CHF':"https://www.investing.com/rss/news_7.rss",'World':"https://www.investing.com/rss/news_25.rss"}
+MARKET_TICKERS = ["^GSPC", "^VIX", "HG=F", "GC=F", "^TNX"] # همه تیکرهای روزانه در یک درخواست دریافت می‌شوند
+# ترتیب قرارداد بازار برای نام‌گذاری جفت‌ها: ارز جلوتر پایه است (EURUSD، NZDJPY، CADCHF و ...)
+CURRENCY_PRIORITY = ["EUR", "GBP", "AUD", "NZD", "USD", "CAD", "CHF", "JPY"]
 CURRENCY_PAIRS_YF = {"EURUSD":"EURUSD=X", "GBPUSD":"GBPUSD=X", "USDJPY":"USDJPY=X", "AUDUSD":"AUDUSD=X", "AUDJPY":"AUDJPY=X", "GBPCAD":"GBPCAD=X", "GBPCHF":"GBPCHF=X", "NZDCAD":"NZDCAD=X", "EURCAD":"EURCAD=X", "USDCAD":"USDCAD=X", "EURGBP":"EURGBP=X"}
 
 # --- بخش جدید: وزن‌دهی به هر ماژول تحلیلی ---
@@ -26,188 +37,377 @@ ANALYSIS_WEIGHTS = {
     "market_regime": 0.2        # رژیم بازار وزن کمتری دارد
 }
 
+# --- قواعد امتیازدهی و یادگیری (در backtester.py هم استفاده می‌شوند) ---
+REGIME_BIAS = 5
+SAFE_HAVENS, COMMODITY_CURRENCIES = ["JPY","CHF","USD"], ["AUD","CAD"]
+# بایاس هر شاخص پیشرو وقتی میانگین ۵ روزه بالای میانگین ۲۰ روزه است
+LEADING_INDICATOR_BIAS = {
+    "HG=F": {"AUD": 4, "CAD": 4},            # مس: امتیاز بیشتر برای ارزهای کالایی
+    "GC=F": {"JPY": 5, "CHF": 5, "USD": -2}, # طلا: ارزهای امن، همبستگی معکوس با دلار
+    "^TNX": {"USD": 6},                      # نرخ بهره ۱۰ ساله: به شدت برای دلار مثبت
+}
+DIVERGENCE_THRESHOLD = 8
+MAX_PREDICTIONS_PER_RUN = 5
+REVIEW_WINDOW_HOURS = (4, 8)
+WEIGHT_LEARNING_RATE = 0.02
+WEIGHT_BOUNDS = (0.5, 1.5)
+# سقف زمان انتظار کل اجرا برای منابع شبکه؛ هر منبع (فیدها، داده بازار، قیمت‌های بررسی) فقط زمان باقی‌مانده را دارد
+RUN_DEADLINE_SECONDS = 25
+
 # --- آبجکت تحلیلگر NLP ---
 nlp_analyzer = SentimentIntensityAnalyzer()
 
 # --- توابع اصلی تحلیل ---
 
-def get_nlp_sentiment_for_feed(rss_url):
+def get_nlp_sentiment_for_feed(entries, cache=None, currency=None):
     """
     نسخه جدید: تحلیل احساسات با استفاده از NLP (VADER) به جای کلمات کلیدی.
-    این تابع زمینه و شدت احساسات را بهتر درک می‌کند.
+    ورودی، سرخط‌های دریافت‌شده توسط news_fetcher است (دانلود همزمان همه فیدها).
+    امتیاز VADER هر سرخط در sentiment_cache نگه داشته می‌شود و فقط وزن زمانی دوباره محاسبه می‌شود.
     """
     try:
-        feed = feedparser.parse(rss_url)
         total_compound_score = 0.0
         now_utc = datetime.now(timezone.utc)
         
-        for entry in feed.entries[:25]:
-            text = entry.get('title', '')
+        for entry in entries[:25]:
+            if entry.get('published') is None:
+                continue # سرخط بدون تاریخ در امتیاز نهایی اثری ندارد
+            age_hours = (now_utc - datetime.fromtimestamp(entry['published'], tz=timezone.utc)).total_seconds() / 3600
+            time_weight = max(0, 1 - (age_hours / 24.0)) # وزن‌دهی زمانی مانند قبل
+            if time_weight == 0:
+                continue
             # استفاده از VADER برای گرفتن امتیاز احساسات
             # امتیاز compound یک نمره نرمال‌شده بین -۱ (بسیار منفی) و +۱ (بسیار مثبت) است
-            sentiment_score = nlp_analyzer.polarity_scores(text)['compound']
-            
-            if 'published_parsed' in entry:
-                age_hours = (now_utc - datetime.fromtimestamp(time.mktime(entry.published_parsed), tz=timezone.utc)).total_seconds() / 3600
-                time_weight = max(0, 1 - (age_hours / 24.0)) # وزن‌دهی زمانی مانند قبل
-                total_compound_score += sentiment_score * time_weight
+            if cache is not None:
+                sentiment_score = cache.get_compound(entry, score_headline, currency)
+            else:
+                with metrics.stage("vader_scoring"):
+                    sentiment_score = score_headline(entry.get('title', ''))
+            total_compound_score += sentiment_score * time_weight
                 
         # تبدیل امتیاز VADER به مقیاس خودمان (مثلا -۱۰ تا +۱۰)
         return int(round(total_compound_score * 10))
-    except:
+    except Exception as e:
+        metrics.fallback(f"sentiment:{currency}", e)
         return 0
 
-def get_robust_market_regime():
+def score_headline(text):
+    return nlp_analyzer.polarity_scores(text)['compound']
+
+def moving_averages(market_data, ticker, windows, engine=None):
+    """میانگین‌های متحرک قیمت بسته شدن؛ در صورت وجود engine به صورت افزایشی محاسبه می‌شوند."""
+    close = column(market_data, 'Close', ticker)
+    if engine is None:
+        return [close.rolling(window=w).mean().iloc[-1] for w in windows]
+    values = engine.update(f"{ticker}:1d:close", close, {f"ma{w}": ("sma", w) for w in windows})
+    return [values[f"ma{w}"] for w in windows]
+
+def get_robust_market_regime(market_data=None, engine=None):
     """
     نسخه جدید: تحلیل رژیم بازار با استفاده از میانگین متحرک و سطح VIX.
     این روش پایدارتر از بررسی تغییرات روزانه است.
     """
     try:
-        sp500_data = yf.Ticker("^GSPC").history(period="1mo")
-        vix_data = yf.Ticker("^VIX").history(period="1mo")
+        if market_data is None:
+            market_data = fetch_with_store(MARKET_TICKERS, period="1mo", deadline=FETCH_DEADLINE_SECONDS)
+        sp500_close = column(market_data, 'Close', "^GSPC")
         
-        sp500_price = sp500_data['Close'].iloc[-1]
-        sp500_ma20 = sp500_data['Close'].rolling(window=20).mean().iloc[-1]
+        sp500_price = sp500_close.iloc[-1]
+        sp500_ma20, = moving_averages(market_data, "^GSPC", [20], engine)
         
-        vix_level = vix_data['Close'].iloc[-1]
+        vix_level = column(market_data, 'Close', "^VIX").iloc[-1]
         
         if sp500_price > sp500_ma20 and vix_level < 20:
             return "Risk-On"
         elif sp500_price < sp500_ma20 and vix_level > 25:
             return "Risk-Off"
         return "Neutral"
-    except:
+    except Exception as e:
+        metrics.fallback("market_regime", e)
         return "Neutral"
 
-def get_leading_indicator_bias():
+def get_leading_indicator_bias(market_data=None, engine=None):
     """
     نسخه جدید: اضافه شدن نرخ بهره اوراق قرضه ۱۰ ساله آمریکا (^TNX)
     به عنوان یک شاخص کلیدی برای قدرت دلار و سلامت اقتصاد.
     """
     bias = {"AUD": 0, "CAD": 0, "JPY": 0, "CHF": 0, "USD": 0, "EUR": 0, "GBP": 0}
     try:
+        if market_data is None:
+            market_data = fetch_with_store(MARKET_TICKERS, period="1mo", deadline=FETCH_DEADLINE_SECONDS)
         # ۱. تحلیل مس (Dr. Copper) - سلامت صنعتی
-        copper = yf.Ticker("HG=F").history(period="1mo")
-        copper_trend = copper['Close'].rolling(window=5).mean().iloc[-1] > copper['Close'].rolling(window=20).mean().iloc[-1]
+        copper_ma5, copper_ma20 = moving_averages(market_data, "HG=F", [5, 20], engine)
+        copper_trend = copper_ma5 > copper_ma20
         if copper_trend:
-            bias["AUD"] += 4 # امتیاز بیشتر برای ارزهای کالایی
-            bias["CAD"] += 4
+            for c, value in LEADING_INDICATOR_BIAS["HG=F"].items(): bias[c] += value
 
         # ۲. تحلیل طلا (Gold) - پناهگاه امن
-        gold = yf.Ticker("GC=F").history(period="1mo")
-        gold_trend = gold['Close'].rolling(window=5).mean().iloc[-1] > gold['Close'].rolling(window=20).mean().iloc[-1]
+        gold_ma5, gold_ma20 = moving_averages(market_data, "GC=F", [5, 20], engine)
+        gold_trend = gold_ma5 > gold_ma20
         if gold_trend:
-            bias["JPY"] += 5 # امتیاز بیشتر برای ارزهای امن
-            bias["CHF"] += 5
-            bias["USD"] -= 2 # همبستگی معکوس قوی‌تر با دلار
+            for c, value in LEADING_INDICATOR_BIAS["GC=F"].items(): bias[c] += value
 
         # ۳. تحلیل نرخ بهره ۱۰ ساله آمریکا (^TNX) - چشم‌انداز اقتصادی و سیاست پولی
-        tnx = yf.Ticker("^TNX").history(period="1mo")
-        tnx_trend = tnx['Close'].rolling(window=5).mean().iloc[-1] > tnx['Close'].rolling(window=20).mean().iloc[-1]
+        tnx_ma5, tnx_ma20 = moving_averages(market_data, "^TNX", [5, 20], engine)
+        tnx_trend = tnx_ma5 > tnx_ma20
         if tnx_trend:
-            bias["USD"] += 6 # روند صعودی نرخ بهره به شدت برای دلار مثبت است
+            for c, value in LEADING_INDICATOR_BIAS["^TNX"].items(): bias[c] += value
             
         print(f"Leading Indicators -> Copper Bullish: {copper_trend}, Gold Bullish: {gold_trend}, 10Y-Yield Bullish: {tnx_trend}")
         return bias
     except Exception as e:
         print(f"Error fetching leading indicators: {e}")
+        metrics.fallback("leading_indicators", e)
         return bias
 
 def load_memory():
     try:
         with open(MEMORY_FILE, "r") as f: return json.load(f)
     except FileNotFoundError:
-        return {"weights": {'USD':1.0,'EUR':1.0,'GBP':1.0,'JPY':1.0,'CAD':1.0,'AUD':1.0,'CHF':1.0}, "last_prediction": {}}
+        return {"weights": {'USD':1.0,'EUR':1.0,'GBP':1.0,'JPY':1.0,'CAD':1.0,'AUD':1.0,'CHF':1.0}, "last_prediction": {}, "open_predictions": []}
 
 def save_memory(data):
-    with open(MEMORY_FILE, "w") as f: json.dump(data, f, indent=2)
-
-# تابع review_past_predictions و generate_dashboard_html بدون تغییر باقی می‌مانند
-# ... (کدهای آن توابع را اینجا کپی کنید) ...
-def review_past_predictions(memory):
-    last_pred = memory.get("last_prediction", {})
-    if not last_pred:
-        return memory
-    
-    pred_time = datetime.fromisoformat(last_pred["timestamp"])
-    # Check if the prediction is between 4 and 8 hours old
-    if not (timedelta(hours=4) < datetime.now() - pred_time < timedelta(hours=8)):
-        return memory
-        
-    print("Reviewing past prediction to update weights...")
-    pair, predicted_move = last_pred["pair"], last_pred["predicted_move"]
-    
+    # نوشتن در فایل موقت و جایگزینی اتمی تا فایل حافظه هرگز نیمه‌کاره نماند
+    with open(MEMORY_FILE + ".tmp", "w") as f: json.dump(data, f, indent=2)
+    os.replace(MEMORY_FILE + ".tmp", MEMORY_FILE)
+
+def load_master_control():
     try:
-        ticker = yf.Ticker(CURRENCY_PAIRS_YF.get(pair)).history(period="1d", interval="1h")
-        start_price = ticker.loc[ticker.index.hour == pred_time.hour]['Close'].iloc[0]
-        end_price = ticker['Close'].iloc[-1]
+        with open(CONTROL_FILE, "r") as f: return json.load(f).get("master_override", "ACTIVE")
+    except: return "ACTIVE"
+
+def pair_ticker(pair):
+    return CURRENCY_PAIRS_YF.get(pair, pair + "=X")
+
+def divergence_matrix(final_sentiments):
+    """
+    ماتریس واگرایی (currencies, D) با D[i, j] = score[i] - score[j] برای هر ارز CURRENCY_PRIORITY که امتیاز دارد.
+    واگرایی جفت base+quote (با i < j، به ترتیب قرارداد بازار) برابر D[i, j] است.
+    """
+    currencies = [c for c in CURRENCY_PRIORITY if c in final_sentiments]
+    scores = np.array([final_sentiments[c] for c in currencies], dtype=np.float64)
+    return currencies, scores[:, None] - scores[None, :]
+
+def rank_predictions(final_sentiments, threshold=DIVERGENCE_THRESHOLD, limit=MAX_PREDICTIONS_PER_RUN, exclude=()):
+    """
+    همه جفت‌ها (شامل کراس‌ها) که واگرایی‌شان از threshold بیشتر است، از قوی‌ترین، حداکثر limit مورد.
+    جفت‌های داخل exclude (آن‌هایی که پیش‌بینی باز دارند) کنار گذاشته می‌شوند.
+    """
+    currencies, matrix = divergence_matrix(final_sentiments)
+    base, quote = np.triu_indices(len(currencies), k=1)
+    divergence = matrix[base, quote]
+    allowed = np.array([currencies[b] + currencies[q] not in exclude for b, q in zip(base, quote)], dtype=bool)
+    above = np.flatnonzero((np.abs(divergence) > threshold) & allowed)
+    ranked = above[np.argsort(-np.abs(divergence[above]), kind="stable")][:limit]
+    return [{"pair": currencies[base[k]] + currencies[quote[k]], "predicted_move": 1 if divergence[k] > 0 else -1,
+             "divergence": float(divergence[k])} for k in ranked]
+
+def load_ledger(path=PREDICTION_LEDGER_FILE):
+    """
+    (predictions, closed ids): رکوردهای پیش‌بینی به ترتیب دفتر و شناسه‌های بررسی‌شده یا منقضی‌شده.
+    فقط یک بار، برای ساختن memory["open_predictions"] از دفتر موجود، استفاده می‌شود.
+    """
+    predictions, closed = [], set()
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("type") == "prediction":
+                    predictions.append(record)
+                else:
+                    closed.add(record["id"])
+    except FileNotFoundError:
+        pass
+    return predictions, closed
+
+def append_to_ledger(records, path=PREDICTION_LEDGER_FILE):
+    if not records:
+        return
+    with open(path, "a") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+
+def prediction_record(prediction, timestamp, rank):
+    return {"type": "prediction", "id": f"{timestamp}:{prediction['pair']}", "pair": prediction["pair"],
+            "ticker": pair_ticker(prediction["pair"]), "predicted_move": prediction["predicted_move"],
+            "divergence": prediction.get("divergence"), "rank": rank, "timestamp": timestamp}
+
+def open_predictions(memory):
+    """
+    پیش‌بینی‌های باز دفتر (هنوز بررسی یا منقضی نشده) که در strategy_data.json نگه داشته می‌شوند تا هیچ اجرایی
+    خود دفتر را نخواند. فقط یک بار از دفتر و last_prediction قدیمی ساخته می‌شوند.
+    """
+    if "open_predictions" not in memory:
+        predictions, closed = load_ledger()
+        memory["open_predictions"] = [pred for pred in predictions if pred["id"] not in closed]
+        last_pred = memory.get("last_prediction", {})
+        if last_pred and "id" not in last_pred:
+            # پیش‌بینی قدیمی (قبل از دفتر پیش‌بینی‌ها) یک بار به دفتر منتقل می‌شود
+            legacy = prediction_record(last_pred, last_pred["timestamp"], 0)
+            append_to_ledger([legacy])
+            memory["open_predictions"].append(legacy)
+            memory["last_prediction"] = dict(last_pred, id=legacy["id"])
+    return memory["open_predictions"]
+
+def time_left(run_deadline, cap):
+    """ثانیه‌های مجاز برای انتظار یک منبع: سقف خود منبع، ولی هرگز بعد از مهلت کل اجرا."""
+    if run_deadline is None:
+        return cap
+    return round(max(0.0, min(cap, run_deadline - time.monotonic())), 1)
+
+def review_past_predictions(memory, run_deadline=None):
+    """
+    بررسی دسته‌ای: هر پیش‌بینی باز ۴ تا ۸ ساعته با یک دریافت ساعتی مشترک برای همه جفت‌ها بررسی می‌شود
+    و وزن‌ها برای هر پیش‌بینی یک بار، به ترتیب دفتر، تنظیم می‌شوند. نتیجه بررسی‌ها و انقضاها به دفتر
+    اضافه و از فهرست پیش‌بینی‌های باز حذف می‌شوند.
+    """
+    pending = open_predictions(memory)
+    now = datetime.now()
+    due, records, closed = [], [], set()
+    for pred in pending:
+        age = now - datetime.fromisoformat(pred["timestamp"])
+        if age >= timedelta(hours=REVIEW_WINDOW_HOURS[1]):
+            records.append({"type": "expired", "id": pred["id"], "at": now.isoformat()})
+            closed.add(pred["id"])
+        elif age > timedelta(hours=REVIEW_WINDOW_HOURS[0]):
+            due.append(pred)
+
+    if due:
+        print(f"Reviewing {len(due)} past predictions to update weights...")
+        try:
+            first_hour = min(datetime.fromisoformat(pred["timestamp"]) for pred in due).replace(minute=0, second=0, microsecond=0)
+            hourly = fetch_with_store(sorted({pred["ticker"] for pred in due}), start=first_hour, interval="1h",
+                                      deadline=time_left(run_deadline, FETCH_DEADLINE_SECONDS))
+        except Exception as e:
+            print(f"Could not fetch prices to verify predictions: {e}")
+            metrics.fallback("prediction_review", e)
+            due, hourly = [], None
+        stale = set(hourly.attrs.get("stale", [])) if hourly is not None else set()
+
+    low, high = WEIGHT_BOUNDS
+    up, down = 1 + WEIGHT_LEARNING_RATE, 1 - WEIGHT_LEARNING_RATE
+    weights = memory["weights"]
+    for pred in due:
+        pair, predicted_move = pred["pair"], pred["predicted_move"]
+        if pred["ticker"] in stale:
+            # با قیمت کهنه یاد نمی‌گیریم؛ پیش‌بینی در اجرای بعدی (هنوز داخل پنجره) بررسی می‌شود
+            print(f"Hourly prices for {pair} are stale, postponing the review.")
+            continue
+        try:
+            pred_time = datetime.fromisoformat(pred["timestamp"])
+            close = column(hourly, 'Close', pred["ticker"])
+            close = close.loc[close.index >= pred_time.replace(minute=0, second=0, microsecond=0)]
+            start_price = close.loc[close.index.hour == pred_time.hour].iloc[0]
+            end_price = close.iloc[-1]
+        except Exception as e:
+            print(f"Could not verify prediction for {pair}: {e}")
+            metrics.fallback("prediction_review", e)
+            continue
         actual_move = 1 if end_price > start_price else -1
-        
         base_curr, quote_curr = pair[:3], pair[3:]
-        
-        if predicted_move == actual_move:
-            # Prediction was correct
-            memory["weights"][base_curr] = min(1.5, memory["weights"][base_curr] * 1.02)
-            memory["weights"][quote_curr] = max(0.5, memory["weights"][quote_curr] * 0.98)
-            print(f"Prediction for {pair} was CORRECT. Adjusting weights.")
+        correct = predicted_move == actual_move
+        if correct:
+            weights[base_curr] = min(high, weights.get(base_curr, 1.0) * up)
+            weights[quote_curr] = max(low, weights.get(quote_curr, 1.0) * down)
         else:
-            # Prediction was wrong
-            memory["weights"][base_curr] = max(0.5, memory["weights"][base_curr] * 0.98)
-            memory["weights"][quote_curr] = min(1.5, memory["weights"][quote_curr] * 1.02)
-            print(f"Prediction for {pair} was WRONG. Adjusting weights.")
-            
-        # Clear the prediction after review
+            weights[base_curr] = max(low, weights.get(base_curr, 1.0) * down)
+            weights[quote_curr] = min(high, weights.get(quote_curr, 1.0) * up)
+        print(f"Prediction for {pair} was {'CORRECT' if correct else 'WRONG'}. Adjusting weights.")
+        records.append({"type": "verification", "id": pred["id"], "actual_move": actual_move, "correct": correct,
+                        "start_price": float(start_price), "end_price": float(end_price), "verified_at": now.isoformat()})
+        closed.add(pred["id"])
+
+    if memory.get("last_prediction", {}).get("id") in closed:
         memory["last_prediction"] = {}
-        return memory
-    except Exception as e:
-        print(f"Could not verify prediction for {pair}: {e}")
-        return memory
+    memory["open_predictions"] = [pred for pred in pending if pred["id"] not in closed]
+    metrics.count("predictions_verified", sum(r["type"] == "verification" for r in records))
+    append_to_ledger(records)
+    return memory
+
 def generate_dashboard_html(data):
     regime_color = {"Risk-On": "#4CAF50", "Risk-Off": "#F44336", "Neutral": "#777"}.get(data['market_regime'], "#777")
     html = f"""
     <html><head><title>AI Dashboard V2</title><meta http-equiv="refresh" content="300">
-    <style>body{{font-family: Consolas, monospace; background: #1e1e1e; color: #d4d4d4;}} table{{width: 600px; margin: auto; border-collapse: collapse;}} td, th{{border: 1px solid #444; padding: 10px; text-align: center;}} th{{background: #2a2d2e;}} .status{{font-size: 1.2em;}} .buy{{color: #50fa7b; font-weight: bold;}} .sell{{color: #ff5555; font-weight: bold;}}</style></head>
+    <style>body{{font-family: Consolas, monospace; background: #1e1e1e; color: #d4d4d4;}} table{{width: 600px; margin: auto; border-collapse: collapse;}} td, th{{border: 1px solid #444; padding: 10px; text-align: center;}} th{{background: #2a2d2e;}} .status{{font-size: 1.2em;}} .buy{{color: #50fa7b; font-weight: bold;}} .sell{{color: #ff5555; font-weight: bold;}} .stale{{color: #ffb86c;}}</style></head>
     <body><h1 style="text-align:center;">Comprehensive AI Trading Dashboard V2</h1>
     <p style="text-align:center;">Last Updated (UTC): {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}</p>
     <table class="status"><tr><th>Master Control</th><th>Market Regime</th></tr>
     <tr><td><b>{data['master_control']}</b></td><td style="color:{regime_color};"><b>{data['market_regime']}</b></td></tr></table>
     <h2 style="text-align:center; margin-top: 40px;">Final Combined Currency Score</h2><table>
     <tr><th>Currency</th><th>Final Score</th></tr>"""
+    stale = data.get('stale', {})
     for currency, score in sorted(data['final_sentiments'].items()):
         if currency == 'World':
             continue
         css_class = 'buy' if score > 5 else 'sell' if score < -5 else ''
-        html += f"<tr><td>{currency}</td><td class='{css_class}'>{score}</td></tr>"
-    html += "</table></body></html>"
+        marker = " <span class='stale'>(stale news)</span>" if currency in stale.get('news', []) else ""
+        html += f"<tr><td>{currency}{marker}</td><td class='{css_class}'>{score}</td></tr>"
+    html += "</table>"
+    stale_sources = [f"news: {', '.join(stale['news'])}" if stale.get('news') else "", f"market data: {', '.join(stale['market_data'])}" if stale.get('market_data') else ""]
+    if any(stale_sources):
+        html += f"<p class='stale' style='text-align:center;'>Stale (last good data used) &mdash; {'; '.join(s for s in stale_sources if s)}</p>"
+    html += "</body></html>"
     return html
-def run_main_analysis():
+def run_main_analysis(memory=None, master_control=None):
+    """
+    یک دور کامل تحلیل. scheduler.py حافظه و کنترل را در RAM نگه می‌دارد و به این تابع می‌دهد؛
+    در اجرای معمولی هر دو از فایل خوانده می‌شوند. حافظه به‌روزشده برگردانده می‌شود.
+    """
+    metrics.start_run("main")
+    run_deadline = time.monotonic() + RUN_DEADLINE_SECONDS
     # ۱. خواندن کنترل دستی
-    try:
-        with open(CONTROL_FILE, "r") as f: master_control = json.load(f).get("master_override", "ACTIVE")
-    except: master_control = "ACTIVE"
+    if master_control is None:
+        master_control = load_master_control()
     
-    # ۲. بارگذاری حافظه و یادگیری از گذشته
-    memory = load_memory()
-    memory = review_past_predictions(memory)
-    
-    # ۳. اجرای تحلیل‌های جدید و قوی‌تر
+    # ۲. دریافت داده‌های این اجرا؛ منابع خروجی (فیدها و داده بازار) اول سهم خود را از مهلت کل اجرا می‌گیرند
+    feed_state = load_feed_state()
+    with metrics.stage("news_fetch"):
+        # فیدهای دیرکرده با سرخط‌های قبلی جایگزین می‌شوند و پاسخ دیرهنگامشان بعداً در feed_state ذخیره می‌شود
+        feed_entries = fetch_all_feeds(CURRENCY_RSS_FEEDS, feed_state, deadline=time_left(run_deadline, FEED_DEADLINE_SECONDS), on_late=save_feed_state)
+    save_feed_state(feed_state)
+    try:
+        market_data = fetch_with_store(MARKET_TICKERS, period="1mo", deadline=time_left(run_deadline, FETCH_DEADLINE_SECONDS))
+    except Exception as e:
+        print(f"Error fetching market data: {e}")
+        metrics.fallback("market_data", e)
+        market_data = pd.DataFrame()
+
+    # ۳. بارگذاری حافظه و یادگیری از گذشته (قبل از استفاده از وزن‌ها، با باقی‌مانده مهلت)
+    if memory is None:
+        memory = load_memory()
+    memory = review_past_predictions(memory, run_deadline)
+    metrics.gauge("run_deadline_left_seconds", run_deadline - time.monotonic())
+
+    # ۴. اجرای تحلیل‌های جدید و قوی‌تر
     weights = memory["weights"]
-    news_sentiments = {currency: get_nlp_sentiment_for_feed(rss_url) * weights.get(currency, 1.0) for currency, rss_url in CURRENCY_RSS_FEEDS.items()}
-    market_regime = get_robust_market_regime()
-    leading_bias = get_leading_indicator_bias()
+    sentiment_cache = SentimentCache()
+    with metrics.stage("news_sentiment"):
+        news_sentiments = {currency: get_nlp_sentiment_for_feed(feed_entries.get(currency, []), sentiment_cache, currency) * weights.get(currency, 1.0) for currency in CURRENCY_RSS_FEEDS}
+    sentiment_cache.evict_expired()
+    sentiment_cache.close()
+    metrics.gauge("sentiment_cache_hit_rate", sentiment_cache.stats()["hit_rate"])
+    metrics.count("sentiment_cache_hits", sentiment_cache.hits)
+    metrics.count("sentiment_cache_misses", sentiment_cache.misses)
+    print(f"Sentiment cache -> {sentiment_cache.stats()}")
+    stale = {"news": sorted(feed_entries.stale), "market_data": list(market_data.attrs.get("stale", []))}
+    indicator_engine = IndicatorEngine()
+    with metrics.stage("indicators"):
+        market_regime = get_robust_market_regime(market_data, indicator_engine)
+        leading_bias = get_leading_indicator_bias(market_data, indicator_engine)
+    indicator_engine.save()
 
-    # ۴. **بخش جدید: ترکیب هوشمندانه تحلیل‌ها با سیستم وزن‌دهی**
+    # ۵. **بخش جدید: ترکیب هوشمندانه تحلیل‌ها با سیستم وزن‌دهی**
     final_sentiments = {c: 0 for c in CURRENCY_RSS_FEEDS.keys()}
     
     # اعمال بایاس رژیم بازار
     regime_bias = {c: 0 for c in CURRENCY_RSS_FEEDS.keys()}
-    safe_havens, commodity_currencies = ["JPY","CHF","USD"], ["AUD","CAD"]
     if market_regime == "Risk-On":
-        for c in commodity_currencies: regime_bias[c] = 5
-        for c in safe_havens: regime_bias[c] = -5
+        for c in COMMODITY_CURRENCIES: regime_bias[c] = REGIME_BIAS
+        for c in SAFE_HAVENS: regime_bias[c] = -REGIME_BIAS
     elif market_regime == "Risk-Off":
-        for c in commodity_currencies: regime_bias[c] = -5
-        for c in safe_havens: regime_bias[c] = 5
+        for c in COMMODITY_CURRENCIES: regime_bias[c] = -REGIME_BIAS
+        for c in SAFE_HAVENS: regime_bias[c] = REGIME_BIAS
 
     # محاسبه امتیاز نهایی هر ارز با ترکیب وزن‌دار
     for currency in final_sentiments.keys():
@@ -222,37 +422,40 @@ def run_main_analysis():
                          
         final_sentiments[currency] = int(round(combined_score))
     
-    # ۵. اعمال کنترل دستی و ذخیره پیش‌بینی
+    # ۶. اعمال کنترل دستی و ذخیره پیش‌بینی
     if master_control == "PAUSE_TRADING":
         for k in final_sentiments: final_sentiments[k] = 0
     else:
-        # منطق پیدا کردن بهترین جفت ارز و ذخیره پیش‌بینی مانند قبل
-        best_pair, best_divergence = None, 0
-        for pair in CURRENCY_PAIRS_YF.keys():
-            base, quote = pair[:3], pair[3:]
-            divergence = final_sentiments.get(base,0) - final_sentiments.get(quote,0)
-            if abs(divergence) > abs(best_divergence):
-                best_divergence, best_pair = divergence, pair
-        
-        # آستانه را کمی بالاتر می‌بریم چون سیستم قوی‌تر شده
-        if abs(best_divergence) > 8:
-            memory["last_prediction"] = {
-                "pair": best_pair, 
-                "predicted_move": 1 if best_divergence > 0 else -1, 
-                "timestamp": datetime.now().isoformat()
-            }
+        # ماتریس واگرایی همه ارزها (شامل جفت‌های کراس)؛ پیش‌بینی‌های بالای آستانه در دفتر ثبت می‌شوند
+        # جفتی که هنوز پیش‌بینی باز دارد دوباره ثبت نمی‌شود، تا یک واگرایی پایدار فقط یک بار در هر پنجره وزن‌ها را تغییر دهد
+        pending = open_predictions(memory)
+        predictions = rank_predictions(final_sentiments, exclude={pred["pair"] for pred in pending})
+        if predictions:
+            timestamp = datetime.now().isoformat()
+            records = [prediction_record(pred, timestamp, rank) for rank, pred in enumerate(predictions)]
+            append_to_ledger(records)
+            pending.extend(records)
+            metrics.count("predictions_made", len(records))
+            # قوی‌ترین پیش‌بینی برای سازگاری با نسخه قبلی در حافظه هم نگه داشته می‌شود
+            best = records[0]
+            memory["last_prediction"] = {"pair": best["pair"], "predicted_move": best["predicted_move"], "timestamp": timestamp, "id": best["id"]}
             
     save_memory(memory)
     
-    # ۶. ساخت و ذخیره خروجی‌ها
-    output_for_robot = {"market_regime": market_regime, "sentiments": final_sentiments}
-    with open(OUTPUT_FILE, "w") as f: json.dump(output_for_robot, f)
+    # ۷. ساخت و ذخیره خروجی‌ها
+    output_for_robot = {"market_regime": market_regime, "sentiments": final_sentiments, "stale": stale}
+    with metrics.stage("write_outputs", OUTPUT_FILE):
+        with open(OUTPUT_FILE, "w") as f: json.dump(output_for_robot, f)
     
-    dashboard_data = {"master_control":master_control, "market_regime":market_regime, "final_sentiments":final_sentiments}
-    with open(DASHBOARD_FILE, "w") as f: f.write(generate_dashboard_html(dashboard_data))
+    dashboard_data = {"master_control":master_control, "market_regime":market_regime, "final_sentiments":final_sentiments, "stale":stale}
+    with metrics.stage("write_outputs", DASHBOARD_FILE):
+        with open(DASHBOARD_FILE, "w") as f: f.write(generate_dashboard_html(dashboard_data))
     
     print(f"V2 analysis complete. Control: {master_control}, Regime: {market_regime}")
     print(f"Final Combined Scores: {final_sentiments}")
+    metrics.finish_run()
+    return memory
 
 if __name__ == "__main__":
-    run_main_analysis()
+    with metrics.profiled("main"):
+        run_main_analysis()
@@ -0,0 +1,134 @@
+# market_data.py - Bulk market-data layer shared by main.py and liquidity_analyzer.py
+import os
+import pandas as pd
+import metrics
+
+# --- تنظیمات ---
+# اگر این متغیر محیطی تنظیم شود، داده‌ها به جای اینترنت از فایل‌های CSV خوانده می‌شوند (برای تست آفلاین)
+MARKET_DATA_DIR_ENV = "MARKET_DATA_DIR"
+DOWNLOAD_TIMEOUT = 20
+PERIOD_OFFSETS = {"1d": pd.DateOffset(days=1), "5d": pd.DateOffset(days=5), "1mo": pd.DateOffset(months=1),
+                  "3mo": pd.DateOffset(months=3), "6mo": pd.DateOffset(months=6), "1y": pd.DateOffset(years=1)}
+OHLC_AGGREGATIONS = {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+
+class MarketDataProvider:
+    """
+    Interface of a market-data source. `download` gets every ticker in one request and
+    returns a frame with (field, ticker) MultiIndex columns, e.g. ('Close', 'EURUSD=X').
+    """
+    def download(self, tickers, start=None, end=None, period=None, interval="1d"):
+        raise NotImplementedError
+
+class YFinanceProvider(MarketDataProvider):
+    def __init__(self, timeout=DOWNLOAD_TIMEOUT):
+        self.timeout = timeout
+
+    def download(self, tickers, start=None, end=None, period=None, interval="1d"):
+        import yfinance as yf
+        kwargs = {"start": start, "end": end} if start is not None else {"period": period or "1mo"}
+        return yf.download(list(tickers), interval=interval, group_by="column", auto_adjust=True,
+                           progress=False, threads=True, timeout=self.timeout, **kwargs)
+
+def _rebase_to_recent(index, now=None):
+    now = pd.Timestamp.now(tz=index.tz) if now is None else now
+    weeks = max(0, (now - index[-1]) // pd.Timedelta(weeks=1))
+    return index + pd.Timedelta(weeks=weeks)
+
+class FileProvider(MarketDataProvider):
+    """
+    Offline stand-in that reads `<directory>/<interval>/<ticker>.csv`.
+    Recorded bars are moved forward by whole weeks until the last one falls within the past
+    week, so absolute `start` dates (as sent by price_store) hit the data and weekdays are kept.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, ticker, interval):
+        return os.path.join(self.directory, interval, f"{ticker}.csv")
+
+    def download(self, tickers, start=None, end=None, period=None, interval="1d"):
+        frames = {}
+        for ticker in tickers:
+            path = self._path(ticker, interval)
+            if not os.path.isfile(path):
+                continue
+            data = pd.read_csv(path, index_col=0, parse_dates=True)
+            if len(data):
+                data.index = _rebase_to_recent(data.index)
+            if start is not None:
+                data = data.loc[(data.index >= pd.Timestamp(start)) & (data.index < pd.Timestamp(end))] if end is not None else data.loc[data.index >= pd.Timestamp(start)]
+            elif len(data):
+                data = data.loc[data.index > data.index[-1] - PERIOD_OFFSETS.get(period or "1mo", PERIOD_OFFSETS["1mo"])]
+            frames[ticker] = data
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+    def record(self, frame, interval="1d"):
+        """Writes a bulk frame back out as one CSV per ticker (used to record fixtures)."""
+        os.makedirs(os.path.join(self.directory, interval), exist_ok=True)
+        for ticker in frame.columns.get_level_values(1).unique():
+            ticker_frame(frame, ticker).dropna(how="all").to_csv(self._path(ticker, interval))
+
+_provider = None
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        directory = os.environ.get(MARKET_DATA_DIR_ENV)
+        _provider = FileProvider(directory) if directory else YFinanceProvider()
+    return _provider
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+def fetch_market_data(tickers, start=None, end=None, period=None, interval="1d"):
+    """Fetches all `tickers` for one run in a single batched request."""
+    tickers = list(dict.fromkeys(tickers))
+    with metrics.stage("market_data_fetch", interval):
+        data = get_provider().download(tickers, start=start, end=end, period=period, interval=interval)
+    metrics.count("tickers_requested", len(tickers))
+    if data is None or data.empty:
+        return pd.DataFrame()
+    if not isinstance(data.columns, pd.MultiIndex):
+        # یک تیکر تنها بدون سطح دوم برگردانده می‌شود
+        data = pd.concat({tickers[0]: data}, axis=1).swaplevel(axis=1)
+    return data
+
+def column(data, field, ticker):
+    """One field of one ticker, without the NaN rows from other tickers' trading calendars."""
+    return data[(field, ticker)].dropna()
+
+def ticker_frame(data, ticker):
+    """All fields of one ticker as a flat-column frame."""
+    if data.empty or ticker not in data.columns.get_level_values(1):
+        return None
+    return data.xs(ticker, axis=1, level=1)
+
+def resample_ohlc(data, rule, offset=None, min_fill=0.0):
+    """
+    Aggregates a (field, ticker) frame to a coarser bar size (e.g. "4h", "1D"). Bars start at
+    multiples of `rule` in UTC moved back by `offset` (e.g. "3h" makes daily bars run 21:00-21:00
+    UTC, the FX session, so the Sunday-evening open belongs to Monday) and are labelled with their
+    true start. Periods in which a ticker has fewer than `min_fill` of the expected base bars are
+    dropped for it, except the latest one, which is still forming. One groupby per field covers
+    every ticker at once; periods in which a ticker had no bars stay NaN for it.
+    """
+    if data.empty:
+        return data
+    index = pd.DatetimeIndex(data.index)
+    shift = pd.Timedelta(offset or 0)
+    key = (index + shift).floor(rule) - shift
+    fields = {}
+    for field, how in OHLC_AGGREGATIONS.items():
+        if field in data.columns.get_level_values(0):
+            grouped = data[field].groupby(key)
+            fields[field] = grouped.sum(min_count=1) if how == "sum" else grouped.agg(how)
+    result = pd.concat(fields, axis=1)
+    if min_fill > 0 and len(index) > 1:
+        expected = pd.Timedelta(rule) / pd.Series(index).diff().median()
+        complete = data["Close"].groupby(key).count() >= min_fill * expected
+        complete.iloc[-1] = True
+        result = result.where(complete.reindex(columns=result.columns, level=1)).dropna(how="all")
+    return result
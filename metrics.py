@@ -0,0 +1,131 @@
+# metrics.py - Per-stage timers, counters and fallback events written alongside the outputs
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- تنظیمات ---
+# هر اجرا یک خط JSON در این فایل (کنار sentiment.txt و multi_currency_analysis.json) اضافه می‌کند
+METRICS_FILE = "metrics.jsonl"
+# فایل در کش workflow نگه داشته می‌شود؛ با رسیدن به این اندازه به metrics.jsonl.1 منتقل می‌شود (فقط یک نسخه قبلی)
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+# با MARKET_ANALYSIS_PROFILE=1 اجرا زیر cProfile انجام می‌شود و خروجی در <script>.prof ذخیره می‌شود
+PROFILE_ENV = "MARKET_ANALYSIS_PROFILE"
+
+class RunMetrics:
+    """
+    Collects one run's measurements. Stage timings are aggregated per name (count/total/max) and,
+    when a key is given, also per key (e.g. "feed_fetch" and "feed_fetch[USD]"). Thread-safe, since
+    feeds are fetched on a thread pool.
+    """
+    def __init__(self, script):
+        self.script = script
+        self.started_at = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.fallbacks = []
+        self.lock = threading.Lock()
+
+    def _add_timing(self, name, seconds):
+        stat = self.stages.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stat["count"] += 1
+        stat["total_seconds"] += seconds
+        stat["max_seconds"] = max(stat["max_seconds"], seconds)
+
+    @contextmanager
+    def stage(self, name, key=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self._add_timing(name, seconds)
+                if key is not None:
+                    self._add_timing(f"{name}[{key}]", seconds)
+
+    def merge_stages(self, stages):
+        """Adds stage timings collected elsewhere (e.g. `RunMetrics.stages` of a worker process)."""
+        with self.lock:
+            for name, other in stages.items():
+                stat = self.stages.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                stat["count"] += other["count"]
+                stat["total_seconds"] += other["total_seconds"]
+                stat["max_seconds"] = max(stat["max_seconds"], other["max_seconds"])
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def fallback(self, source, reason):
+        """A source failed and a default or cached value was used instead of a real reading."""
+        with self.lock:
+            self.fallbacks.append({"source": source, "reason": str(reason)[:200], "at": datetime.now().isoformat()})
+            self.counters["fallbacks"] = self.counters.get("fallbacks", 0) + 1
+
+    def to_dict(self):
+        return {"script": self.script, "started_at": self.started_at,
+                "duration_seconds": time.perf_counter() - self.start,
+                "stages": self.stages, "counters": self.counters, "gauges": self.gauges, "fallbacks": self.fallbacks}
+
+    def write(self, path=METRICS_FILE, max_bytes=METRICS_MAX_BYTES):
+        if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            os.replace(path, path + ".1")
+        with open(path, "a") as f: f.write(json.dumps(self.to_dict()) + "\n")
+
+_current = RunMetrics("default")
+
+def start_run(script):
+    global _current
+    _current = RunMetrics(script)
+    return _current
+
+def finish_run(path=METRICS_FILE):
+    _current.write(path)
+    slowest = sorted(((n, s["total_seconds"]) for n, s in _current.stages.items() if "[" not in n), key=lambda x: -x[1])[:5]
+    print(f"Metrics ({_current.script}): " + ", ".join(f"{n}={s:.3f}s" for n, s in slowest)
+          + f"; fallbacks={len(_current.fallbacks)} -> '{path}'")
+    return _current
+
+def stage(name, key=None):
+    return _current.stage(name, key)
+
+def merge_stages(stages):
+    _current.merge_stages(stages)
+
+def count(name, value=1):
+    _current.count(name, value)
+
+def gauge(name, value):
+    _current.gauge(name, value)
+
+def fallback(source, reason):
+    _current.fallback(source, reason)
+
+@contextmanager
+def profiled(script):
+    """Runs the block under cProfile when MARKET_ANALYSIS_PROFILE is set; otherwise does nothing."""
+    if not os.environ.get(PROFILE_ENV):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{script}.prof")
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(20)
+        print(out.getvalue())
@@ -0,0 +1,143 @@
+# news_fetcher.py - Concurrent, conditional-GET RSS fetching for main.py
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+import feedparser
+import metrics
+
+# --- تنظیمات ---
+FEED_STATE_FILE = "feed_state.json"
+MAX_FEED_WORKERS = 9
+MAX_ENTRIES_PER_FEED = 25
+# فیدهایی که تا این مهلت جواب ندهند با سرخط‌های ذخیره‌شده (کهنه) جایگزین می‌شوند
+FEED_DEADLINE_SECONDS = 10
+# feedparser خودش timeout ندارد، پس دانلود با urllib و این timeout (برای هر عملیات سوکت) انجام می‌شود
+FEED_TIMEOUT_SECONDS = 30
+
+_state_lock = threading.Lock()
+
+def load_feed_state(path=FEED_STATE_FILE):
+    try:
+        with open(path, "r") as f: return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_feed_state(state, path=FEED_STATE_FILE):
+    with _state_lock:
+        with open(path + ".tmp", "w") as f: json.dump(state, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+def _entry_record(entry):
+    """Keeps only the fields the sentiment stage needs, so the state file stays small."""
+    published = None
+    if entry.get('published_parsed'):
+        published = time.mktime(entry.published_parsed)
+    return {"id": entry.get('id') or entry.get('link') or "", "title": entry.get('title', ''), "published": published}
+
+def _download(url, cached, timeout):
+    """
+    Conditional GET with its own timeout: (status, body, headers); status None on failure.
+    Header names are lowercased, since servers may send "etag" as well as "ETag".
+    """
+    headers = {"User-Agent": feedparser.USER_AGENT}
+    if cached.get("etag"): headers["If-None-Match"] = cached["etag"]
+    if cached.get("modified"): headers["If-Modified-Since"] = cached["modified"]
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+            return response.status, response.read(), {k.lower(): v for k, v in response.headers.items()}
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return 304, b"", {k.lower(): v for k, v in e.headers.items()}
+        print(f"HTTP {e.code} for {url}")
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Download failed for {url}: {e}")
+    return None, b"", {}
+
+def fetch_feed(url, cached=None, timeout=FEED_TIMEOUT_SECONDS):
+    """
+    Downloads one feed, sending back the stored ETag/Last-Modified.
+    Returns (record, status); on 304 or a failed download the cached record is reused.
+    """
+    cached = cached or {}
+    status, body, headers = _download(url, cached, timeout)
+    if status == 304 or status is None:
+        return cached, status
+    feed = feedparser.parse(body, response_headers=headers)
+    record = {
+        "etag": headers.get("etag"),
+        "modified": headers.get("last-modified"),
+        "entries": [_entry_record(e) for e in feed.entries[:MAX_ENTRIES_PER_FEED]],
+    }
+    return record, status
+
+def _timed_fetch(name, url, cached):
+    with metrics.stage("feed_fetch", name):
+        return fetch_feed(url, cached)
+
+class FeedResults(dict):
+    """{name: entries}, plus `stale`: names whose entries are the stored ones from an earlier run."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stale = set()
+
+def _store_late(state, url, on_late):
+    def callback(future):
+        try:
+            record, status = future.result()
+        except Exception:
+            return
+        if status is None:
+            return
+        with _state_lock:
+            state[url] = record
+        if on_late is not None:
+            on_late(state)
+    return callback
+
+def fetch_all_feeds(feeds, state=None, max_workers=MAX_FEED_WORKERS, deadline=None, on_late=None):
+    """
+    Fetches every feed in `feeds` ({name: url}) at once on a bounded thread pool.
+    `state` ({url: record}) is updated in place; returns FeedResults ({name: entries}).
+    Feeds still pending after `deadline` seconds fall back to their stored entries and are
+    listed in `.stale`; they keep downloading in the background and, when they arrive,
+    update `state` and call `on_late(state)` (e.g. save_feed_state).
+    The deadline bounds when the results are available, not process exit: concurrent.futures
+    joins its threads at interpreter shutdown, so a late download can still hold the process
+    for up to FEED_TIMEOUT_SECONDS per blocked socket operation.
+    """
+    state = state if state is not None else {}
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(feeds))))
+    futures = {name: pool.submit(_timed_fetch, name, url, state.get(url)) for name, url in feeds.items()}
+    wait(futures.values(), timeout=deadline)
+    pool.shutdown(wait=False)
+    results, not_modified = FeedResults(), 0
+    for name, future in futures.items():
+        url = feeds[name]
+        if not future.done():
+            print(f"Feed {name} missed the {deadline}s deadline, using stored headlines.")
+            metrics.fallback(f"feed:{name}", f"deadline of {deadline}s exceeded, using stored headlines")
+            future.add_done_callback(_store_late(state, url, on_late))
+            results.stale.add(name)
+            results[name] = state.get(url, {}).get("entries", [])
+            continue
+        try:
+            record, status = future.result()
+        except Exception as e:
+            print(f"Error fetching feed {name}: {e}")
+            record, status = state.get(url, {}), None
+        if status == 304: not_modified += 1
+        if status is None:
+            metrics.fallback(f"feed:{name}", "download failed, using cached headlines" if record.get("entries") else "download failed, no cached headlines")
+            results.stale.add(name)
+        with _state_lock:
+            state[url] = record
+        results[name] = record.get("entries", [])
+    metrics.count("feeds_fetched", len(feeds))
+    metrics.count("feeds_not_modified", not_modified)
+    metrics.count("feeds_stale", len(results.stale))
+    print(f"Fetched {len(feeds)} feeds ({not_modified} not modified, {len(results.stale)} stale).")
+    return results
@@ -0,0 +1,185 @@
+# price_store.py - Incremental local OHLCV store (memory-mapped NumPy files per symbol and interval)
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from market_data import fetch_market_data, ticker_frame, PERIOD_OFFSETS
+import metrics
+
+# --- تنظیمات ---
+PRICE_STORE_DIR = "price_store"
+FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+# درخواست‌هایی که تا این مهلت تمام نشوند با میله‌های ذخیره‌شده جایگزین می‌شوند و در پس‌زمینه ادامه می‌یابند
+FETCH_DEADLINE_SECONDS = 15
+
+def _to_utc_ns(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    return index.as_unit("ns").asi8
+
+def _atomic_save(path, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class PriceStore:
+    """
+    Keeps every series as two files: `<ticker>.ts.npy` (int64 UTC nanoseconds) and
+    `<ticker>.ohlcv.npy` (float64, one column per field). `meta.json` holds the last
+    stored timestamp of each series, so a run only asks the provider for the missing tail.
+    """
+    def __init__(self, directory=PRICE_STORE_DIR):
+        self.directory = directory
+        self._lock = threading.RLock() # نوشتن‌های دیرهنگام پس‌زمینه با خواندن همزمان تداخل نکنند
+
+    def _dir(self, interval):
+        return os.path.join(self.directory, interval)
+
+    def _paths(self, ticker, interval):
+        base = os.path.join(self._dir(interval), ticker)
+        return base + ".ts.npy", base + ".ohlcv.npy"
+
+    def _load_meta(self, interval):
+        try:
+            with open(os.path.join(self._dir(interval), "meta.json"), "r") as f: return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_meta(self, interval, meta):
+        path = os.path.join(self._dir(interval), "meta.json")
+        with open(path + ".tmp", "w") as f: json.dump(meta, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def read(self, ticker, interval="1d", start=None):
+        """
+        Zero-copy view of one series from `start` on: (timestamps, ohlcv) memory-mapped arrays,
+        or (None, None) when the series is not stored.
+        """
+        ts_path, values_path = self._paths(ticker, interval)
+        if not os.path.isfile(ts_path):
+            return None, None
+        ts = np.load(ts_path, mmap_mode="r")
+        values = np.load(values_path, mmap_mode="r")
+        i = 0 if start is None else int(np.searchsorted(ts, _to_utc_ns([pd.Timestamp(start)])[0]))
+        return ts[i:], values[i:]
+
+    def write(self, ticker, interval, new_ts, new_values):
+        """
+        Merges freshly downloaded bars into the stored series. Every stored bar at or after the
+        first new bar is replaced, which covers both a revised last bar and back-filled gaps.
+        """
+        if len(new_ts) == 0:
+            return
+        os.makedirs(self._dir(interval), exist_ok=True)
+        ts, values = self.read(ticker, interval)
+        if ts is not None:
+            keep = int(np.searchsorted(ts, new_ts[0]))
+            new_ts = np.concatenate([ts[:keep], new_ts])
+            new_values = np.concatenate([values[:keep], new_values])
+            del ts, values # memmap باید قبل از جایگزینی فایل بسته شود
+        ts_path, values_path = self._paths(ticker, interval)
+        _atomic_save(values_path, np.ascontiguousarray(new_values, dtype=np.float64))
+        _atomic_save(ts_path, np.ascontiguousarray(new_ts, dtype=np.int64))
+
+    def _fetch_group(self, group, resume, end, interval):
+        """Downloads one bulk request and writes it; safe to finish after the run has moved on."""
+        try:
+            data = fetch_market_data(group, start=resume.to_pydatetime(), end=end, interval=interval)
+        except Exception as e:
+            print(f"Price store: fetch from {resume} failed, keeping stored bars: {e}")
+            metrics.fallback(f"prices:{interval}", f"fetch of {len(group)} tickers failed, using stored bars: {e}")
+            return False
+        updated = {}
+        for ticker in group:
+            frame = ticker_frame(data, ticker)
+            if frame is None:
+                continue
+            frame = frame.reindex(columns=FIELDS).dropna(subset=["High", "Low", "Close"])
+            if frame.empty:
+                continue
+            with self._lock:
+                self.write(ticker, interval, _to_utc_ns(frame.index), frame.to_numpy(dtype=np.float64))
+            metrics.count("price_store_bars_downloaded", len(frame))
+            updated[ticker] = pd.Timestamp(_to_utc_ns(frame.index[-1:])[0]).isoformat()
+        with self._lock:
+            meta = self._load_meta(interval)
+            meta.update(updated)
+            covered = meta.setdefault("_covered_from", {})
+            for ticker in updated:
+                if ticker not in covered or resume < pd.Timestamp(covered[ticker]):
+                    covered[ticker] = resume.isoformat()
+            self._save_meta(interval, meta)
+        return True
+
+    def update(self, tickers, start, end=None, interval="1d", deadline=None):
+        """
+        Downloads only what is missing: series that are already stored from `start` to past it
+        are requested from their last bar (re-fetched in case it was still forming), the rest
+        (new, or stored only from a later start) from `start`. Tickers with the same resume point
+        share one bulk request.
+        Returns the tickers left on stored bars: their request failed or is still running after
+        `deadline` seconds (it then keeps going in the background and updates the store late).
+        """
+        meta = self._load_meta(interval)
+        start = pd.Timestamp(start)
+        groups = {}
+        covered = meta.get("_covered_from", {})
+        for ticker in tickers:
+            last, covered_from = meta.get(ticker), covered.get(ticker)
+            complete = last is not None and covered_from is not None and pd.Timestamp(covered_from) <= start <= pd.Timestamp(last)
+            resume = pd.Timestamp(last) if complete else start
+            groups.setdefault(resume, []).append(ticker)
+
+        pool = ThreadPoolExecutor(max_workers=max(1, len(groups)))
+        futures = {pool.submit(self._fetch_group, group, resume, end, interval): group for resume, group in sorted(groups.items())}
+        wait(futures, timeout=deadline)
+        pool.shutdown(wait=False)
+        stale = set()
+        for future, group in futures.items():
+            if not future.done():
+                print(f"Price store: {len(group)} {interval} tickers missed the {deadline}s deadline, using stored bars.")
+                metrics.fallback(f"prices:{interval}", f"deadline of {deadline}s exceeded for {len(group)} tickers, using stored bars")
+                stale.update(group)
+            elif not future.result():
+                stale.update(group)
+        return stale
+
+    def frame(self, tickers, start=None, interval="1d"):
+        """Stored bars from `start` on, in the same (field, ticker) layout as market_data.fetch_market_data."""
+        frames = {}
+        for ticker in tickers:
+            with self._lock:
+                ts, values = self.read(ticker, interval, start)
+            if ts is not None and len(ts):
+                frames[ticker] = pd.DataFrame(values, index=pd.DatetimeIndex(ts.astype("datetime64[ns]")), columns=FIELDS, copy=False)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = PriceStore()
+    return _store
+
+def fetch_with_store(tickers, start=None, end=None, period=None, interval="1d", deadline=None):
+    """
+    Drop-in for market_data.fetch_market_data that goes through the local store:
+    only the missing tail of each series is downloaded, the lookback is served from disk.
+    Tickers served from stored bars only (failed or past `deadline`) are listed in
+    `frame.attrs["stale"]`.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if start is None:
+        start = datetime.now() - PERIOD_OFFSETS.get(period or "1mo", PERIOD_OFFSETS["1mo"])
+    store = get_store()
+    stale = store.update(tickers, start, end=end, interval=interval, deadline=deadline)
+    data = store.frame(tickers, start=start, interval=interval)
+    data.attrs["stale"] = sorted(stale)
+    return data
@@ -0,0 +1,103 @@
+# scheduler.py - Warm long-running daemon for main.py and liquidity_analyzer.py
+import time
+PROCESS_START = time.perf_counter() # قبل از import کتابخانه‌های سنگین
+
+import argparse
+import json
+import os
+from datetime import datetime
+import main as sentiment_analysis
+import liquidity_analyzer
+
+# --- تنظیمات ---
+MAIN_INTERVAL_SECONDS = 300
+LIQUIDITY_INTERVAL_SECONDS = 300
+SCHEDULER_STATS_FILE = "scheduler_stats.json"
+POLL_SECONDS = 1.0
+
+def _atomic_write_json(path, data):
+    with open(path + ".tmp", "w") as f: json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+class Scheduler:
+    """
+    Runs both analyzers on their own intervals inside one warm process. pandas, yfinance, scipy
+    and the VADER lexicon are imported once; strategy_data.json and control.json are kept in memory,
+    control.json is reloaded when its mtime changes, and state is flushed with atomic replaces.
+    """
+    def __init__(self, main_interval=MAIN_INTERVAL_SECONDS, liquidity_interval=LIQUIDITY_INTERVAL_SECONDS,
+                 workers=liquidity_analyzer.ANALYSIS_WORKERS, stats_file=SCHEDULER_STATS_FILE):
+        self.jobs = {"main": [main_interval, 0.0], "liquidity": [liquidity_interval, 0.0]} # [interval, next_run]
+        self.workers = workers
+        self.stats_file = stats_file
+        self.memory = sentiment_analysis.load_memory()
+        self.master_control = sentiment_analysis.load_master_control()
+        self.control_mtime = _mtime(sentiment_analysis.CONTROL_FILE)
+        self.stats = {"started_at": datetime.now().isoformat(),
+                      "startup_seconds": time.perf_counter() - PROCESS_START,
+                      "cycles": {name: [] for name in self.jobs}}
+        print(f"Scheduler ready in {self.stats['startup_seconds']:.2f}s (imports + state load)")
+
+    def reload_control_if_changed(self):
+        mtime = _mtime(sentiment_analysis.CONTROL_FILE)
+        if mtime != self.control_mtime:
+            self.control_mtime = mtime
+            self.master_control = sentiment_analysis.load_master_control()
+            print(f"control.json changed -> master_override = {self.master_control}")
+
+    def run_job(self, name):
+        start = time.perf_counter()
+        try:
+            if name == "main":
+                self.memory = sentiment_analysis.run_main_analysis(self.memory, self.master_control)
+            else:
+                liquidity_analyzer.main(self.workers)
+        except Exception as e:
+            print(f"Scheduler: {name} cycle failed: {e}")
+        elapsed = time.perf_counter() - start
+        self.stats["cycles"][name].append(elapsed)
+        self.flush_stats()
+        return elapsed
+
+    def flush_stats(self):
+        summary = dict(self.stats)
+        for name, durations in self.stats["cycles"].items():
+            steady = durations[1:] or durations
+            summary[name] = {"runs": len(durations),
+                             "first_cycle_seconds": durations[0] if durations else None,
+                             "steady_state_mean_seconds": sum(steady) / len(steady) if steady else None}
+        summary["cycles"] = {name: durations[-100:] for name, durations in self.stats["cycles"].items()}
+        _atomic_write_json(self.stats_file, summary)
+
+    def run(self, max_cycles=None):
+        """Loops until interrupted (or until every job has run `max_cycles` times)."""
+        try:
+            while max_cycles is None or any(len(d) < max_cycles for d in self.stats["cycles"].values()):
+                self.reload_control_if_changed()
+                now = time.monotonic()
+                for name, job in self.jobs.items():
+                    if now >= job[1] and (max_cycles is None or len(self.stats["cycles"][name]) < max_cycles):
+                        job[1] = now + job[0]
+                        print(f"\n=== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {name} cycle ===")
+                        print(f"{name} cycle finished in {self.run_job(name):.2f}s")
+                time.sleep(POLL_SECONDS)
+        except KeyboardInterrupt:
+            print("Scheduler stopped.")
+        finally:
+            sentiment_analysis.save_memory(self.memory)
+            self.flush_stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run both analyzers in one warm process")
+    parser.add_argument("--main-interval", type=float, default=MAIN_INTERVAL_SECONDS)
+    parser.add_argument("--liquidity-interval", type=float, default=LIQUIDITY_INTERVAL_SECONDS)
+    parser.add_argument("--workers", type=int, default=liquidity_analyzer.ANALYSIS_WORKERS)
+    parser.add_argument("--cycles", type=int, help="stop after this many runs of each job")
+    args = parser.parse_args()
+    Scheduler(args.main_interval, args.liquidity_interval, args.workers).run(args.cycles)
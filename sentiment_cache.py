@@ -0,0 +1,73 @@
+# sentiment_cache.py - Disk-backed headline sentiment cache (SQLite)
+import hashlib
+import os
+import sqlite3
+import time
+import metrics
+
+# --- تنظیمات ---
+SENTIMENT_CACHE_FILE = "sentiment_cache.db"
+CACHE_TTL_HOURS = 24.0 # همان پنجره وزن‌دهی زمانی؛ سرخط‌های قدیمی‌تر وزنی ندارند
+# آرشیو سرخط‌ها برای backtester.py در فایل جدا و با سقف نگهداری
+HEADLINE_ARCHIVE_FILE = "headline_archive.db"
+ARCHIVE_RETENTION_DAYS = 90
+
+def headline_key(entry):
+    """Entry GUID when the feed provides one, otherwise a hash of the title."""
+    return entry.get('id') or hashlib.sha1(entry.get('title', '').encode("utf-8")).hexdigest()
+
+class SentimentCache:
+    """
+    Stores the VADER compound score of each headline so it is scored only once.
+    Only the time weight has to be recomputed on later runs.
+    """
+    def __init__(self, path=SENTIMENT_CACHE_FILE, ttl_hours=CACHE_TTL_HOURS, archive_path=None, retention_days=ARCHIVE_RETENTION_DAYS):
+        self.ttl_seconds = ttl_hours * 3600
+        self.retention_seconds = retention_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS headlines (key TEXT PRIMARY KEY, compound REAL NOT NULL, published REAL)")
+        # آرشیو در پایگاه جدا کنار کش (یا مسیر داده‌شده) نگه داشته می‌شود
+        if archive_path is None:
+            archive_path = os.path.join(os.path.dirname(path), HEADLINE_ARCHIVE_FILE)
+        self.conn.execute("ATTACH DATABASE ? AS history", (archive_path,))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS history.archive (currency TEXT NOT NULL, key TEXT NOT NULL, compound REAL NOT NULL, published REAL, PRIMARY KEY (currency, key))")
+        if self.conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'archive'").fetchone():
+            # آرشیو نسخه قبلی داخل خود کش بود
+            self.conn.execute("INSERT OR IGNORE INTO history.archive SELECT * FROM main.archive")
+            self.conn.execute("DROP TABLE main.archive")
+
+    def get_compound(self, entry, scorer, currency=None):
+        """Cached compound score of one headline; with `currency` the headline is also archived for backtests."""
+        key = headline_key(entry)
+        row = self.conn.execute("SELECT compound FROM headlines WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.hits += 1
+            compound = row[0]
+        else:
+            self.misses += 1
+            with metrics.stage("vader_scoring"):
+                compound = scorer(entry.get('title', ''))
+            self.conn.execute("INSERT OR REPLACE INTO headlines VALUES (?, ?, ?)", (key, compound, entry.get('published')))
+        if currency is not None:
+            self.conn.execute("INSERT OR IGNORE INTO history.archive VALUES (?, ?, ?, ?)", (currency, key, compound, entry.get('published')))
+        return compound
+
+    def archived_headlines(self, since, until):
+        """(currency, published, compound) rows of archived headlines published in [since, until]."""
+        return self.conn.execute("SELECT currency, published, compound FROM history.archive WHERE published BETWEEN ? AND ?", (since, until)).fetchall()
+
+    def evict_expired(self, now=None):
+        """Drops cache rows older than the TTL and archive rows older than the retention period."""
+        now = now if now is not None else time.time()
+        self.conn.execute("DELETE FROM history.archive WHERE published IS NULL OR published < ?", (now - self.retention_seconds,))
+        return self.conn.execute("DELETE FROM headlines WHERE published IS NULL OR published < ?", (now - self.ttl_seconds,)).rowcount
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()